@@ -0,0 +1,36 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from youtubewatched import convert_takeout
+
+
+def _write_watch_history(path, first_video: int):
+    entries = [{'header': 'YouTube',
+                'title': f'Watched Video {number}',
+                'titleUrl': f'https://www.youtube.com/watch?v=v{number:09}',
+                'subtitles': [{'name': 'A channel',
+                               'url': 'https://www.youtube.com/channel/UCa'}],
+                'time': f'2019-05-30T{number % 24:02}:00:00.000Z'}
+               for number in range(first_video, first_video + 20)]
+    path.write_text(json.dumps(entries))
+
+
+@pytest.mark.parametrize('files_amount', [1, 3])
+def test_a_process_per_file_at_most(tmp_path, monkeypatch, files_amount):
+    for number in range(files_amount):
+        _write_watch_history(tmp_path / f'watch-history-{number}.json',
+                             number * 20)
+    pool_sizes = []
+
+    def executor(max_workers):
+        pool_sizes.append(max_workers)
+        return ThreadPoolExecutor(max_workers)
+
+    monkeypatch.setattr(convert_takeout, 'ProcessPoolExecutor', executor)
+    records = list(convert_takeout.get_all_records(
+        str(tmp_path), streaming=True, processes=64, columnar=True))[-1]
+
+    assert pool_sizes == ([files_amount] if files_amount > 1 else [])
+    assert records['total_videos'] == files_amount * 20
@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from youtubewatched.utils.dedupe import (first_unique_mask, is_duplicate_mask,
+                                         remove_duplicates, to_datetimes,
+                                         to_epochs)
+from youtubewatched.utils.gen import (
+    remove_timestamps_from_one_list_from_another,
+    timestamp_is_unique_in_list)
+
+# timestamps are scattered around these, so that many of them are within
+# MAX_TIME_DIFFERENCE (25h) of each other, either side of a month's or a
+# year's end
+ANCHORS = [datetime(2018, 12, 31, 23, 59, 59), datetime(2019, 2, 1),
+           datetime(2019, 3, 31, 12, 30), datetime(2019, 6, 15, 0, 0, 30)]
+# besides whole hours (the same timestamp in another timezone), timestamps
+# are off by a second or a minute, or exactly a whole hour away from 25h
+NUDGES = [timedelta(0)] * 6 + [timedelta(seconds=seconds) for seconds in
+                               (-60, -59, -1, 1, 59, 60, 3600, -3600)]
+SEEDS = range(20)
+
+
+def random_timestamps(rand: random.Random, amount: int) -> list:
+    return [rand.choice(ANCHORS) + timedelta(hours=rand.randint(-26, 26)) +
+            rand.choice(NUDGES) for _ in range(amount)]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_first_unique_mask(seed):
+    rand = random.Random(seed)
+    for _ in range(50):
+        timestamps = random_timestamps(rand, rand.randrange(60))
+        groups = [rand.randrange(3) for _ in timestamps]
+        kept_lists = {}
+        expected = [timestamp_is_unique_in_list(
+            timestamp, kept_lists.setdefault(group, []), insert=True)
+            for timestamp, group in zip(timestamps, groups)]
+
+        mask = first_unique_mask(to_epochs(timestamps), np.array(groups))
+        assert mask.tolist() == expected
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_is_duplicate_mask(seed):
+    rand = random.Random(seed)
+    for _ in range(50):
+        incumbents = sorted(random_timestamps(rand, rand.randrange(40)))
+        candidates = random_timestamps(rand, rand.randrange(40))
+        expected = [not timestamp_is_unique_in_list(candidate, incumbents)
+                    for candidate in candidates]
+
+        mask = is_duplicate_mask(to_epochs(candidates), to_epochs(incumbents))
+        assert mask.tolist() == expected
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_remove_duplicates(seed):
+    rand = random.Random(seed)
+    for _ in range(50):
+        filter_ = random_timestamps(rand, rand.randrange(40))
+        filteree = sorted(random_timestamps(rand, rand.randrange(40)))
+        left = to_datetimes(remove_duplicates(to_epochs(filter_),
+                                              to_epochs(filteree)))
+
+        remove_timestamps_from_one_list_from_another(filter_, filteree)
+        assert left == filteree
+
+
+def test_empty():
+    empty = to_epochs([])
+    one = to_epochs([datetime(2019, 1, 1)])
+    assert first_unique_mask(empty).tolist() == []
+    assert is_duplicate_mask(empty, one).tolist() == []
+    assert is_duplicate_mask(one, empty).tolist() == [False]
+    assert remove_duplicates(empty, one).tolist() == one.tolist()
+    assert remove_duplicates(one, empty).tolist() == []
@@ -0,0 +1,13 @@
+import pytest
+
+from youtubewatched import youtube
+from youtubewatched.headless import benchmark_pipeline
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_fake_benchmark_with_errors(seed, monkeypatch):
+    monkeypatch.setattr(youtube, 'backoff_delay', lambda attempt: 0)
+    stats = benchmark_pipeline(videos=200, latency=0, error_rate=0.2,
+                               rate_limit_rate=0.2, seed=seed)
+    assert stats['fake_api']['errors']
+    assert set(stats) == {'import', 'update', 'fake_api'}
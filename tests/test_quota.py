@@ -0,0 +1,25 @@
+import sqlite3
+
+from youtubewatched import quota as quota_module
+from youtubewatched.quota import QuotaAccount
+
+
+def test_units_saved_under_the_day_they_were_spent(monkeypatch):
+    days = ['2019-05-30']
+    monkeypatch.setattr(quota_module, 'quota_day', lambda: days[-1])
+    conn = sqlite3.connect(':memory:')
+    quota = QuotaAccount(conn, budget=10)
+    assert quota.reserve('videos.list', 8)
+
+    days.append('2019-05-31')  # the quota resets before the units are saved
+    assert quota.reserve('videos.list', 3)
+    assert quota.spent == 3
+    assert quota.remaining == 7
+
+    quota.save()
+    assert quota.spent == 3
+    assert quota.usage('2019-05-30') == {
+        'videos.list': {'requests': 8, 'units': 8}}
+    assert quota.usage('2019-05-31') == {
+        'videos.list': {'requests': 3, 'units': 3}}
+    conn.close()
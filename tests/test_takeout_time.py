@@ -0,0 +1,85 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from youtubewatched.utils.gen import datetime_to_epoch
+from youtubewatched.utils.takeout_time import (HTML_FORMAT, JSON_FORMAT,
+                                               made_up_timestamps,
+                                               parse_html_timestamp,
+                                               parse_json_timestamp)
+
+HTML_EDGE_CASES = [
+    'Jan 1, 2019, 12:00:00 AM CET', 'Jan 1, 2019, 12:00:00 PM CET',
+    'Dec 31, 2019, 11:59:59 PM EST', 'Feb 29, 2020, 1:02:03 AM UTC',
+    'Feb 29, 2019, 1:02:03 AM UTC', 'Feb 30, 2020, 1:02:03 AM UTC',
+    'Jun 31, 2019, 1:02:03 AM UTC', 'Mar 05, 2019, 01:02:03 PM PDT',
+    'Mar 5, 2019, 13:02:03 PM PDT', 'Mar 5, 2019, 0:02:03 AM PDT',
+    'Mar 5, 2019, 1:60:03 AM PDT', 'Mar 5, 2019, 1:02:60 AM PDT',
+    'Mar 5, 2019, 1:2:3 AM PDT', 'Mar 5, 2019, 1:02:03 XM PDT',
+    'Mar 5, 2019, 1:02:03 am PDT', 'Mar 5, 19, 1:02:03 AM PDT',
+    'Mar 5, 2019, 1:02:03 AM', 'Mrz 5, 2019, 1:02:03 AM PDT',
+    'Mar 5 2019, 1:02:03 AM PDT', 'Mar  5, 2019, 1:02:03 AM PDT',
+    'Mar 5, 2019, 1:02:03  AM PDT', 'Mar 5, 2019, +1:02:03 AM PDT',
+    'Mar 5, 2019, 1:02:03 AM GMT+01:00', '', 'Watched a video']
+JSON_EDGE_CASES = [
+    '2019-01-01T00:00:00Z', '2019-12-31T23:59:59.999Z',
+    '2020-02-29T12:00:00.1Z', '2019-02-29T12:00:00Z',
+    '2019-04-31T12:00:00Z', '2019-13-01T12:00:00Z', '2019-00-01T12:00:00Z',
+    '2019-01-01T24:00:00Z', '2019-01-01T23:60:00Z', '2019-01-01T23:59:60Z',
+    '2019-1-01T12:00:00Z', '2019-01-01 12:00:00Z', '2019/01/01T12:00:00Z',
+    '2019-01-01T12:00', '2019-01-01T+1:00:00Z', '', 'not a time']
+
+
+def _strptime_html(text: str):
+    return datetime.strptime(text[:text.rfind(' ')], HTML_FORMAT)
+
+
+def _strptime_json(text: str):
+    return datetime.strptime(text[:19], JSON_FORMAT)
+
+
+def _assert_same(parse, parse_with_strptime, text: str):
+    try:
+        expected = parse_with_strptime(text)
+    except ValueError:
+        with pytest.raises(ValueError):
+            parse(text)
+        with pytest.raises(ValueError):
+            parse(text, epoch=True)
+        return
+    assert parse(text) == expected
+    assert parse(text, epoch=True) == datetime_to_epoch(expected)
+
+
+def _corrupted(rand: random.Random, text: str) -> str:
+    """text with a character replaced, removed or added"""
+    ind = rand.randrange(len(text) + 1)
+    character = rand.choice('0123456789 :,-TZAPM')
+    return rand.choice([text[:ind] + character + text[ind + 1:],
+                        text[:ind] + text[ind + 1:],
+                        text[:ind] + character + text[ind:]])
+
+
+@pytest.mark.parametrize('text', HTML_EDGE_CASES)
+def test_html_edge_cases(text):
+    _assert_same(parse_html_timestamp, _strptime_html, text)
+
+
+@pytest.mark.parametrize('text', JSON_EDGE_CASES)
+def test_json_edge_cases(text):
+    _assert_same(parse_json_timestamp, _strptime_json, text)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_same_as_strptime(seed):
+    rand = random.Random(seed)
+    html, json_ = made_up_timestamps(2000, seed)
+    for text in html:
+        _assert_same(parse_html_timestamp, _strptime_html, text)
+        _assert_same(parse_html_timestamp, _strptime_html,
+                     _corrupted(rand, text))
+    for text in json_:
+        _assert_same(parse_json_timestamp, _strptime_json, text)
+        _assert_same(parse_json_timestamp, _strptime_json,
+                     _corrupted(rand, text))
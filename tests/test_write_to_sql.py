@@ -0,0 +1,127 @@
+import copy
+from datetime import datetime
+
+from youtubewatched import write_to_sql, youtube
+from youtubewatched.fake_api import FakeYouTubeApi, installed, make_records
+from youtubewatched.utils.sql import sqlite_connection
+
+
+def _categories(conn) -> list:
+    return conn.execute('SELECT id FROM categories ORDER BY id;').fetchall()
+
+
+def test_categories_retried_and_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(youtube, 'backoff_delay', lambda attempt: 0)
+    api = FakeYouTubeApi(latency=0)
+    conn = sqlite_connection(str(tmp_path / 'yt.sqlite'), types=True)
+    with installed(api) as api_auth:
+        write_to_sql.setup_tables(conn, api_auth)
+        categories = _categories(conn)
+        assert categories
+
+        # a server error and a rate limit, then the request goes through
+        get_categories = youtube.get_categories
+        failures = [youtube.ApiTransientError('API server error 503',
+                                              'server_error'),
+                    youtube.ApiQuotaError('API quota/rate limit exceeded',
+                                          'rateLimitExceeded')]
+
+        def flaky_get_categories(*args, **kwargs):
+            if failures:
+                raise failures.pop(0)
+            return get_categories(*args, **kwargs)
+
+        monkeypatch.setattr(youtube, 'get_categories', flaky_get_categories)
+        write_to_sql.insert_or_refresh_categories(conn, api_auth)
+        assert not failures
+        assert _categories(conn) == categories
+
+        # failing for good leaves the table as it was
+        api.error_rate = 1
+        monkeypatch.setattr(youtube, 'get_categories', get_categories)
+        write_to_sql.insert_or_refresh_categories(conn, api_auth)
+        assert _categories(conn) == categories
+    conn.close()
+
+
+def test_dict_records_resume_after_quota_runs_out(tmp_path, monkeypatch):
+    records = make_records(400)
+    records['youtube_music'] = {'timestamps': [datetime(2018, 5, 1, 12)]}
+    records['unknown'] = {'timestamps': [datetime(2018, 5, 2, 12)]}
+    original = copy.deepcopy(records)
+    # enough for the categories and 150 of the videos
+    api = FakeYouTubeApi(latency=0, missing_rate=0, quota=4)
+    waits = []
+
+    def quota_reset(should_stop=None):
+        waits.append(api.units_spent)
+        api.quota = None
+        return True
+
+    monkeypatch.setattr(write_to_sql, 'wait_for_quota_reset', quota_reset)
+    conn = sqlite_connection(str(tmp_path / 'yt.sqlite'), types=True)
+    with installed(api) as api_auth:
+        quota = write_to_sql.open_quota_account(conn)
+        write_to_sql.setup_tables(conn, api_auth, quota)
+        insert = lambda: write_to_sql.insert_videos(conn, records, api_auth,
+                                                    0, quota=quota)
+        for _ in write_to_sql.run_until_done(insert, conn, quota):
+            pass
+
+    assert waits == [4]
+    assert records == original
+    assert conn.execute('SELECT count(*) FROM videos;').fetchone()[0] == 402
+    assert conn.execute('SELECT count(*) FROM videos_timestamps;'
+                        ).fetchone()[0] == sum(
+        len(record['timestamps']) for record in original.values())
+    assert write_to_sql.get_job(conn, 'insert', 400) is None
+    conn.close()
+
+
+def test_update_reports_unchanged_records(tmp_path):
+    api = FakeYouTubeApi(latency=0, missing_rate=0)
+    db_path = str(tmp_path / 'yt.sqlite')
+    conn = sqlite_connection(db_path, types=True)
+    with installed(api) as api_auth:
+        write_to_sql.setup_tables(conn, api_auth)
+        for _ in write_to_sql.insert_videos(conn, make_records(150),
+                                            api_auth, 0):
+            pass
+        conn.close()
+        # as in update_db
+        conn = sqlite_connection(db_path)
+        # a cutoff of -1 updates all the records; the fake API's videos
+        # don't change, so neither do their ETags
+        progress = list(write_to_sql.update_videos(conn, api_auth, -1, 0))
+    assert progress[-1][1] == 150
+    assert progress[-1][2] == 0
+    assert progress[-1][6] == 150
+    conn.close()
+
+
+def test_insert_journaled_when_budget_runs_out(tmp_path):
+    records = make_records(400)
+    api = FakeYouTubeApi(latency=0, missing_rate=0)
+    conn = sqlite_connection(str(tmp_path / 'yt.sqlite'), types=True)
+    with installed(api) as api_auth:
+        # the categories and 3 requests' worth (150) of the videos
+        quota = write_to_sql.open_quota_account(conn, 4)
+        write_to_sql.setup_tables(conn, api_auth, quota)
+        for _ in write_to_sql.insert_videos(conn, records, api_auth, 0,
+                                            quota=quota):
+            pass
+        assert quota.exhausted
+        job = write_to_sql.get_job(conn, 'insert', 400)
+        assert job['position'] == 150
+        assert job['last_id'] == list(records)[149]
+
+        requests_before = api.requests
+        quota = write_to_sql.open_quota_account(conn, 10000)
+        for _ in write_to_sql.insert_videos(conn, records, api_auth, 0,
+                                            quota=quota):
+            pass
+    # only the records after the journaled position are requested
+    assert api.requests - requests_before == 5
+    assert conn.execute('SELECT count(*) FROM videos;').fetchone()[0] == 400
+    assert write_to_sql.get_job(conn, 'insert', 400) is None
+    conn.close()
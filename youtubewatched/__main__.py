@@ -1,18 +1,247 @@
+from os.path import join
+
 import click
 
-from youtubewatched.config import PORT
+from youtubewatched.config import PORT, API_CONCURRENCY
+
+project_option = click.option(
+    '--project', default='.', show_default=True,
+    type=click.Path(exists=True, file_okay=False),
+    help='Project directory, with the database and the api_key file')
+verbosity_option = click.option(
+    '-v', '--verbosity', default=1, show_default=True,
+    type=click.IntRange(0, 3), help='Logging verbosity level')
+api_cache_option = click.option(
+    '--api-cache', 'api_cache_path', type=click.Path(dir_okay=False),
+    help='API response cache file to use instead of the project\'s own, '
+         'e.g. one shared between projects')
+budget_option = click.option(
+    '--budget', type=click.IntRange(1),
+    help='API quota units the project can spend today, instead of its daily '
+         'budget (see the quota command)')
+no_wait_option = click.option(
+    '--no-wait', is_flag=True,
+    help='Stop once the daily API quota (or budget) runs out, instead of '
+         'waiting for it to reset and continuing')
+concurrency_option = click.option(
+    '-c', '--concurrency', default=API_CONCURRENCY, show_default=True,
+    type=click.IntRange(1), help='API requests made at once')
+cutoff_option = click.option(
+    '--cutoff', default=2, show_default=True, type=click.IntRange(0),
+    help='Update records last updated more than this many cutoff units ago')
+unit_option = click.option(
+    '--unit', default='days', show_default=True,
+    type=click.Choice(['minutes', 'hours', 'days', 'weeks']),
+    help='Cutoff unit')
+UNIT_SECONDS = {'minutes': 60, 'hours': 3600, 'days': 86400, 'weeks': 604800}
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('-d', '--debug', 'debug', is_flag=True,
               help='Enable debugging mode (Flask)')
 @click.option('-p', '--port', default=PORT,
               help=f'Server port (default: {PORT})')
-def launch(debug, port):
+@click.pass_context
+def launch(ctx, debug, port):
+    """Starts the web interface, unless a command is given"""
+    if ctx.invoked_subcommand is not None:
+        return
     # import is here as the --help command takes way too long otherwise
     from youtubewatched.dash_layout import dash_app
     dash_app.run_server(port=port, debug=debug)
 
 
+def _run_headless(project_path: str, function, *args, **kwargs) -> dict:
+    from youtubewatched import youtube
+    from youtubewatched.utils.gen import logging_config
+
+    logging_config(join(project_path, 'events.log'),
+                   log_server_requests=False)
+    try:
+        return function(*args, project_path=project_path, **kwargs)
+    except (youtube.ApiKeyError, youtube.ApiQuotaError,
+            FileNotFoundError) as e:
+        raise click.ClickException(str(e))
+
+
+def _echo_stats(stats: dict):
+    if 'entries' in stats:
+        click.echo(f'Takeout entries: {stats["entries"]} in '
+                   f'{stats["parse_seconds"]}s '
+                   f'({stats["entries_per_second"]} entries/s), '
+                   f'{stats["failed_entries"]} failed to parse')
+        for failed_file in stats['failed_files']:
+            click.echo(f'Could not process {failed_file}')
+    if 'records_unchanged' in stats:
+        click.echo(f'Records updated: {stats["records_updated"]}, unchanged '
+                   f'since the last update: {stats["records_unchanged"]}')
+    click.echo(f'API requests: {stats["api_requests"]} '
+               f'({stats["api_requests_per_second"]} requests/s), '
+               f'cached responses used: {stats["api_cache_hits"]} of '
+               f'{stats["api_cache_hits"] + stats["api_cache_misses"]}')
+    if stats['api_retries']:
+        click.echo('API requests retried: ' + ', '.join(
+            f'{amount} ({kind.replace("_", " ")})'
+            for kind, amount in stats['api_retries'].items()))
+    tags_looked_up = stats['tag_cache_hits'] + stats['tag_cache_misses']
+    if tags_looked_up:
+        click.echo(f'Tag IDs found in memory: {stats["tag_cache_hits"]} of '
+                   f'{tags_looked_up} '
+                   f'({stats["tag_cache_hits"] / tags_looked_up:.1%})')
+    click.echo(f'Quota units spent: {stats["quota_units_spent"]}, '
+               f'{stats["quota_remaining"]} left in today\'s budget')
+    if stats['quota_exhausted']:
+        click.echo('Stopped early, as the daily quota budget ran out; run '
+                   'again once it resets, at midnight Pacific time')
+    click.echo(f'Rows written: {stats["rows_written"]} in '
+               f'{stats["db_seconds"]}s ({stats["rows_per_second"]} rows/s)')
+    click.echo(f'Videos in the database: {stats["records_in_db"]}')
+
+
+@launch.command('import')
+@click.argument('takeout_path', type=click.Path(exists=True))
+@project_option
+@verbosity_option
+@concurrency_option
+@api_cache_option
+@budget_option
+@no_wait_option
+@click.option('--full-reconcile', is_flag=True,
+              help='Process all entries, not only the ones newer than the '
+                   'newest in the database (for adding older Takeouts)')
+def import_(takeout_path, project, verbosity, concurrency, api_cache_path,
+            budget, no_wait, full_reconcile):
+    """Adds Takeout watch history to the project's database"""
+    # the headless module never loads Dash, pandas or plotly
+    from youtubewatched.headless import import_takeout
+    _echo_stats(_run_headless(project, import_takeout, takeout_path,
+                              verbosity=verbosity,
+                              full_reconcile=full_reconcile,
+                              concurrency=concurrency,
+                              api_cache_path=api_cache_path, budget=budget,
+                              wait_for_quota=not no_wait))
+
+
+@launch.command()
+@project_option
+@verbosity_option
+@concurrency_option
+@api_cache_option
+@budget_option
+@no_wait_option
+@cutoff_option
+@unit_option
+def update(project, verbosity, concurrency, api_cache_path, budget, no_wait,
+           cutoff, unit):
+    """Updates the project's video records with current data from the API"""
+    from youtubewatched.headless import update_records
+    _echo_stats(_run_headless(project, update_records,
+                              cutoff=cutoff * UNIT_SECONDS[unit],
+                              verbosity=verbosity, concurrency=concurrency,
+                              api_cache_path=api_cache_path, budget=budget,
+                              wait_for_quota=not no_wait))
+
+
+@launch.command()
+@project_option
+@cutoff_option
+@unit_option
+@click.option('--set-budget', 'budget', type=click.IntRange(0),
+              help='Set the API quota units the project can spend per day, '
+                   '0 for the full daily quota')
+def quota(project, cutoff, unit, budget):
+    """
+    Shows the API quota spent by the project today and how much an update
+    would take
+    """
+    from youtubewatched.headless import quota_status
+    status = quota_status(project, cutoff * UNIT_SECONDS[unit], budget)
+    click.echo(f'Quota spent on {status["day"]} (Pacific time): '
+               f'{status["spent"]} of {status["budget"]} units, '
+               f'{status["remaining"]} left')
+    for method, usage in sorted(status['usage'].items()):
+        click.echo(f'  {method}: {usage["requests"]} requests, '
+                   f'{usage["units"]} units')
+    click.echo(f'Updating the {status["records_to_update"]} records last '
+               f'updated more than {cutoff} {unit} ago would take up to '
+               f'{status["update_units"]} units')
+
+
+@launch.command('api-benchmark')
+@project_option
+@click.option('--calls', default=5, show_default=True,
+              type=click.IntRange(1),
+              help='Calls to time per kind of connection, 1 quota unit each '
+                   '(plus one to open the pooled connection)')
+def api_benchmark(project, calls):
+    """Times the API client's startup and the latency of calls"""
+    from youtubewatched.headless import benchmark_api
+    stats = _run_headless(project, benchmark_api, calls=calls)
+    click.echo(f'Client startup: {stats["startup_bundled_ms"]} ms with the '
+               f'bundled discovery document, '
+               f'{stats["startup_fetched_ms"]} ms with the fetched one')
+    if stats['quota_exhausted']:
+        click.echo('The daily quota budget ran out before the calls')
+    for kind in ['pooled_calls', 'new_connection_calls']:
+        if kind in stats:
+            click.echo(f'{kind.replace("_", " ").capitalize()}: '
+                       f'{stats[kind]["min_ms"]} ms min, '
+                       f'{stats[kind]["median_ms"]} ms median, '
+                       f'{stats[kind]["max_ms"]} ms max')
+
+
+@launch.command('fake-benchmark')
+@click.option('--videos', default=2000, show_default=True,
+              type=click.IntRange(1), help='Made up records to insert')
+@concurrency_option
+@click.option('--latency', default=0.05, show_default=True,
+              type=click.FloatRange(0), help='Seconds each request takes')
+@click.option('--error-rate', default=0.0, show_default=True,
+              type=click.FloatRange(0, 1),
+              help='Share of requests that fail with a server error')
+@click.option('--rate-limit-rate', default=0.0, show_default=True,
+              type=click.FloatRange(0, 1),
+              help='Share of requests that fail with a rate limit error')
+@click.option('--quota', type=click.IntRange(0),
+              help='Requests served before failing with a quota error')
+@click.option('--seed', default=0, show_default=True, help='Random seed')
+@click.option('--existing', default=0, show_default=True,
+              type=click.IntRange(0),
+              help='Videos already in the database before the import, e.g. '
+                   '200000 to see how the import scales with its size')
+def fake_benchmark(videos, concurrency, latency, error_rate, rate_limit_rate,
+                   quota, seed, existing):
+    """
+    Times importing and then updating made up records in a temporary
+    database, against a local stand-in for the API (no network or quota)
+    """
+    from youtubewatched.headless import benchmark_pipeline
+    stats = benchmark_pipeline(videos, concurrency, latency, error_rate,
+                               rate_limit_rate, quota, seed, existing)
+    fake_api = stats.pop('fake_api')
+    for name, run_stats in stats.items():
+        click.echo(f'{name.capitalize()}:')
+        _echo_stats(run_stats)
+    click.echo(f'Stand-in API: {fake_api["requests"]} requests, '
+               f'{fake_api["errors"]} of them failed, '
+               f'{fake_api["units_spent"]} quota units spent')
+
+
+@launch.command('timestamp-benchmark')
+@click.option('--amount', default=300000, show_default=True,
+              type=click.IntRange(1), help='Timestamps to parse per format')
+@click.option('--seed', default=0, show_default=True, help='Random seed')
+def timestamp_benchmark(amount, seed):
+    """
+    Times parsing made up Takeout timestamps, compared to parsing them with
+    strptime
+    """
+    from youtubewatched.headless import benchmark_timestamps
+    for name, stats in benchmark_timestamps(amount, seed).items():
+        click.echo(f'{name.upper()} timestamps: {stats["fast_seconds"]}s, '
+                   f'{stats["strptime_seconds"]}s with strptime '
+                   f'({stats["speedup"]}x)')
+
+
 if __name__ == '__main__':
     launch()
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from os.path import join, expanduser
+
+from youtubewatched.config import (API_CACHE_NAME, API_CACHE_MAX_AGE,
+                                   API_CACHE_SHARED_PATH)
+
+"""
+API responses for each video are kept in an SQLite file, so rebuilding a
+project's database from Takeout (e.g. after a schema change), or adding the
+same Takeout to another project, doesn't spend quota on videos that were
+fetched recently.
+"""
+
+
+class ApiResponseCache:
+    """
+    videos.list responses per video ID (see youtube.get_videos_info), zlib
+    compressed, with the time they were fetched at. Responses older than
+    max_age seconds are ignored, and replaced once fetched again.
+
+    Can be shared between threads, and between projects by passing the same
+    path.
+    """
+
+    def __init__(self, path: str, max_age: int = API_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                             id text primary key,
+                             fetched_at integer,
+                             response blob
+                             );''')
+        self.conn.commit()
+
+    def get(self, video_ids: list, max_age: int = None) -> dict:
+        """
+        Returns the responses for the videos that were fetched no longer than
+        max_age (or the cache's max_age, whichever is shorter) seconds ago
+        """
+        if max_age is None or max_age > self.max_age:
+            max_age = self.max_age
+        if not video_ids:
+            return {}
+        placeholders = ', '.join('?' * len(video_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT id, response FROM responses '
+                f'WHERE fetched_at >= ? AND id IN ({placeholders});',
+                (int(time.time()) - max_age, *video_ids)).fetchall()
+            self.hits += len(rows)
+            self.misses += len(video_ids) - len(rows)
+        return {video_id: json.loads(zlib.decompress(response))
+                for video_id, response in rows}
+
+    def put(self, responses: dict):
+        fetched_at = int(time.time())
+        rows = [(video_id, fetched_at,
+                 zlib.compress(json.dumps(response).encode()))
+                for video_id, response in responses.items() if response]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO responses '
+                                  '(id, fetched_at, response) '
+                                  'VALUES (?, ?, ?);', rows)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_api_cache(project_path: str, path: str = None) -> ApiResponseCache:
+    """
+    Opens the cache at path, API_CACHE_SHARED_PATH if that's set, or the
+    project's own one
+    """
+    path = path or API_CACHE_SHARED_PATH
+    if path:
+        return ApiResponseCache(expanduser(path))
+    return ApiResponseCache(join(project_path, API_CACHE_NAME))
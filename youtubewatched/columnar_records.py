@@ -0,0 +1,130 @@
+from collections.abc import Mapping
+from datetime import datetime
+
+import numpy as np
+
+from youtubewatched.utils.dedupe import first_unique_mask, remove_duplicates
+from youtubewatched.utils.gen import epoch_to_datetime
+
+"""
+Takeout records for hundreds of thousands of entries take up hundreds of MB
+as dicts of lists of datetime objects, most of which are the timestamps.
+ColumnarRecords keeps those as two NumPy arrays instead - a video code and
+epoch seconds per timestamp - and only the values of each video (title,
+channel, etc.) as dicts.
+"""
+
+
+class ColumnarRecords(Mapping):
+    """
+    Records from Takeout, readable the same way as get_all_records' dict of
+    video ID: {'timestamps': [...], 'title': ..., ...}. The dicts are built
+    on access, so changing them doesn't change the records, but pop does.
+
+    Timestamps are added in file order, the way get_all_records merges them,
+    then deduplicated by finalize, after which the records are read-only,
+    apart from pop. The arrays are sorted by video code and then timestamp,
+    with a video's range given by offsets[code]:offsets[code + 1].
+    """
+
+    def __init__(self):
+        self.video_ids = ['unknown']
+        self.values = [{}]
+        self.codes = None
+        self.timestamps = None
+        self.offsets = None
+        self._index = {'unknown': 0}
+        self._code_chunks = []
+        self._timestamp_chunks = []
+
+    def code_of(self, video_id: str) -> int:
+        """
+        Returns the video's code, adding the video with empty values (see
+        the values attribute) if it's new
+        """
+        code = self._index.get(video_id)
+        if code is None:
+            code = self._index[video_id] = len(self.video_ids)
+            self.video_ids.append(video_id)
+            self.values.append({})
+        return code
+
+    def add_timestamps(self, codes, timestamps):
+        """
+        Adds timestamps as epoch seconds, with codes from code_of. Should be
+        called in the order the timestamps would be added to a dict of records
+        """
+        if len(codes):
+            self._code_chunks.append(np.array(codes, dtype=np.int32))
+            self._timestamp_chunks.append(np.array(timestamps, dtype=np.int64))
+
+    def finalize(self):
+        """
+        Drops timestamps that are duplicates of ones added before them (see
+        first_unique_mask), then the unknown timestamps that are duplicates
+        of known ones, same as get_all_records does for dicts
+        """
+        if self._code_chunks:
+            codes = np.concatenate(self._code_chunks)
+            timestamps = np.concatenate(self._timestamp_chunks)
+        else:
+            codes = np.empty(0, dtype=np.int32)
+            timestamps = np.empty(0, dtype=np.int64)
+        self._code_chunks = self._timestamp_chunks = None
+
+        keep = first_unique_mask(timestamps, codes)
+        codes, timestamps = codes[keep], timestamps[keep]
+        order = np.lexsort((timestamps, codes))
+        codes, timestamps = codes[order], timestamps[order]
+
+        unknown = np.searchsorted(codes, 1)
+        known = timestamps[unknown:]  # by video, then time
+        unk_timestamps = remove_duplicates(
+            known, np.setdiff1d(timestamps[:unknown], known))
+        codes = np.concatenate(
+            [np.zeros(len(unk_timestamps), dtype=np.int32), codes[unknown:]])
+        timestamps = np.concatenate([unk_timestamps, known])
+
+        self.codes, self.timestamps = codes, timestamps
+        self.offsets = np.searchsorted(codes,
+                                       np.arange(len(self.video_ids) + 1))
+
+    def timestamps_of(self, video_id: str) -> np.ndarray:
+        """A video's timestamps as sorted epoch seconds"""
+        code = self._index[video_id]
+        return self.timestamps[self.offsets[code]:self.offsets[code + 1]]
+
+    @property
+    def timestamps_amount(self) -> int:
+        return sum(len(self.timestamps_of(video_id)) for video_id in self)
+
+    def newest_timestamp(self) -> datetime:
+        newest = max((self.timestamps_of(video_id)[-1] for video_id in self
+                      if len(self.timestamps_of(video_id))), default=None)
+        if newest is not None:
+            return epoch_to_datetime(int(newest))
+
+    def __getitem__(self, video_id: str) -> dict:
+        return {'timestamps': [epoch_to_datetime(int(ts))
+                               for ts in self.timestamps_of(video_id)],
+                **self.values[self._index[video_id]]}
+
+    def __iter__(self):
+        return (video_id for video_id in self.video_ids
+                if video_id in self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def pop(self, video_id: str, *default):
+        try:
+            record = self[video_id]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self._index[video_id]
+        return record
+
+    def to_dict(self) -> dict:
+        return {video_id: self[video_id] for video_id in self}
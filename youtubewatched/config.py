@@ -3,6 +3,8 @@ from datetime import timedelta
 PORT = 5000
 
 DB_NAME = 'yt.sqlite'
+# parsed watch-history files are kept here, in the project directory
+PARSE_CACHE_DIR = 'takeout_cache'
 
 video_keys_and_columns = (
     'id', 'publishedAt',
@@ -20,6 +22,29 @@ video_keys_and_columns = (
     'actualStartTime'
 )
 
+# API responses per video are kept here, in the project directory, or in
+# API_CACHE_SHARED_PATH for all projects if it's set (e.g.
+# '~/youtubewatched_api_cache.sqlite'). Ones older than API_CACHE_MAX_AGE
+# (seconds) are requested again
+API_CACHE_NAME = 'api_cache.sqlite'
+API_CACHE_SHARED_PATH = None
+API_CACHE_MAX_AGE = 86400 * 30
+
+# units of API quota a project gets per day (10000 by default for new Google
+# Cloud projects); a lower daily budget can be set per project
+API_DAILY_QUOTA = 10000
+
+# API requests made at once, and at most this many per second on average
+API_CONCURRENCY = 4
+API_REQUESTS_PER_SECOND = 25
+# failed requests are made up to API_RETRIES times in all, waiting a random
+# time of up to API_BACKOFF_BASE seconds, doubled with each retry (capped at
+# API_BACKOFF_CAP), in between. Only server, transport and rate limit errors
+# are retried
+API_RETRIES = 5
+API_BACKOFF_BASE = 0.5
+API_BACKOFF_CAP = 30
+
 video_parts_to_get = ','.join([
     "contentDetails",  # 2
     "id",  # 0
@@ -29,6 +54,27 @@ video_parts_to_get = ','.join([
     "liveStreamingDetails"  # 2
 ])
 
+# the part of a video's API resource each of video_keys_and_columns is in,
+# used to request only those keys (the quota cost of the parts stays the same)
+video_keys_parts = {
+    'id': None,  # top level
+    'publishedAt': 'snippet',
+    'channelId': 'snippet',
+    'title': 'snippet',
+    'description': 'snippet',
+    'channelTitle': 'snippet',
+    'tags': 'snippet',
+    'categoryId': 'snippet',
+    'defaultAudioLanguage': 'snippet',
+    'duration': 'contentDetails',
+    'viewCount': 'statistics',
+    'likeCount': 'statistics',
+    'dislikeCount': 'statistics',
+    'commentCount': 'statistics',
+    'relevantTopicIds': 'topicDetails',
+    'actualStartTime': 'liveStreamingDetails'
+}
+
 '''YouTube Takeout seems to return timestamps in local time,
 but without a concrete timezone.
 In case archives were downloaded in different parts of the world, the same 
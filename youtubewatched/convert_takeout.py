@@ -1,17 +1,33 @@
+import hashlib
+import io
 import itertools
+import json
 import logging
 import os
+import pickle
 import re
+import tarfile
 import unicodedata
+import zipfile
+import zlib
 
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
+from html.parser import HTMLParser
 from os.path import join
 from typing import Union
 
 from bs4 import BeautifulSoup as BSoup
 
+from youtubewatched.columnar_records import ColumnarRecords
+from youtubewatched.utils.dedupe import (remove_duplicates, to_datetimes,
+                                         to_epochs)
 from youtubewatched.utils.gen import (
-    timestamp_is_unique_in_list, remove_timestamps_from_one_list_from_another)
+    timestamp_is_unique_in_list, datetime_to_epoch, epoch_to_datetime)
+from youtubewatched.utils.takeout_time import (parse_html_timestamp,
+                                               parse_json_timestamp)
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +63,13 @@ as divs with the same class also wrap every video entry individually.
 
 watch_url_re = re.compile(r'watch\?v=')
 channel_url_re = re.compile(r'youtube\.com/channel')
+watch_history_extensions = ('.html', '.json')
+zip_extensions = ('.zip',)
+tar_extensions = ('.tgz', '.tar.gz')
+archive_errors = (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error,
+                  OSError)
+archive_member_re = re.compile(
+    r'(^|/)Takeout/YouTube[^/]*/history/watch-history\.(html|json)$')
 dt_re = re.compile(
     r'[a-zA-Z]{3} \d{1,2}, \d{4}, \d{1,2}:\d{1,2}:\d{1,2} [APM]{2} ')
 
@@ -60,15 +83,32 @@ def extract_video_id_from_url(url):
     return video_id
 
 
+def _takeout_name(path: str) -> Union[str, None]:
+    """
+    Returns the name of a Takeout archive or the directory it was extracted
+    to, without the extension, if the path is one
+    """
+    for extension in zip_extensions + tar_extensions:
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+            break
+    if path.startswith('takeout-2') and path[-5:-3] == 'Z-':
+        return path
+
+
 def get_watch_history_files(takeout_path: str = '.'):
     """
-    Locates watch-history.html files in a given path.
+    Locates watch-history.html/.json files in a given path.
 
     Only works if the provided path points to any of the following:
      - a single file itself, ex.
      <root dir>/Takeout/YouTube/history/watch-history.html
+     - a Takeout archive (.zip or .tgz)
      - a directory with watch-history file(s)
-     - a directory with directories of extracted Takeout archives
+     - a directory with Takeout archives and/or directories of extracted ones
+
+    Archives are returned as they are, the watch-history file gets read from
+    them directly.
 
     The search will become confined to one of these types after the first
     match, i.e. if a watch-history file is found in the directory that was
@@ -77,7 +117,7 @@ def get_watch_history_files(takeout_path: str = '.'):
     Processing will be slightly faster if the files are ordered chronologically.
     """
     if os.path.isfile(takeout_path):
-        if 'watch-history' in takeout_path:
+        if 'watch-history' in takeout_path or _is_archive(takeout_path):
             return [takeout_path]
         else:
             return
@@ -85,22 +125,48 @@ def get_watch_history_files(takeout_path: str = '.'):
     dir_contents = os.listdir(takeout_path)
     watch_histories = []
     for path in dir_contents:
-        if path.startswith('watch-history') and path.endswith('.html'):
+        if (path.startswith('watch-history') and
+                path.endswith(watch_history_extensions)):
             watch_histories.append(os.path.join(takeout_path, path))
 
     if watch_histories:
         return watch_histories  # assumes a directory with a single
         # watch-history file or with multiple ones (with something appended to
         # the end of their file names)
-    for path in dir_contents:
-        if path.startswith('takeout-2') and path[-5:-3] == 'Z-':
-            full_path = os.path.join(takeout_path, path, 'Takeout', 'YouTube',
-                                     'history', 'watch-history.html')
-            if os.path.exists(full_path):
-                watch_histories.append(os.path.join(takeout_path, full_path))
-            else:
-                logger.warning(f'Expected watch-history.html in {path}, '
-                               f'found none')
+    for path in sorted(dir_contents):
+        takeout_name = _takeout_name(path)
+        if not takeout_name:
+            continue
+        full_path = os.path.join(takeout_path, path)
+        if _is_archive(path):
+            if takeout_name in dir_contents:
+                continue  # already extracted
+            if path.endswith(zip_extensions):
+                try:
+                    with zipfile.ZipFile(full_path) as archive:
+                        if _find_zip_member(archive) is None:
+                            logger.warning(f'Expected watch-history.html or '
+                                           f'watch-history.json in {path}, '
+                                           f'found none')
+                            continue
+                except zipfile.BadZipFile:
+                    logger.warning(f'{path} is not a valid zip archive')
+                    continue
+            # .tgz archives can't be searched without reading them through,
+            # which is left for parsing
+            watch_histories.append(full_path)
+            continue
+
+        history_dir = os.path.join(full_path, 'Takeout', 'YouTube', 'history')
+        for extension in watch_history_extensions:
+            history_path = os.path.join(history_dir,
+                                        'watch-history' + extension)
+            if os.path.exists(history_path):
+                watch_histories.append(history_path)
+                break
+        else:
+            logger.warning(f'Expected watch-history.html or '
+                           f'watch-history.json in {path}, found none')
 
     return watch_histories
 
@@ -122,25 +188,709 @@ fluff = [  # the order should not be changed
     ('>', '>\n')
 ]
 done_ = '<span id="Done">'
+entry_div_class = 'content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1'
 
+STREAM_CHUNK_SIZE = 1024 * 1024  # characters read per chunk when streaming
+CACHE_HASH_CHUNK_SIZE = 1024 * 1024
+# bump whenever a change to parsing alters its output, which invalidates
+# previously cached results
+PARSER_VERSION = 1
+
+json_title_prefix = 'Watched '
 removed_string = 'Watched a video that has been removed'
 story_string = 'Watched story'
 
 
+class _WatchHistoryParser(HTMLParser):
+    """
+    Incremental (push) parser for watch-history.html content.
+
+    Collects the same pieces of each entry that the Beautiful Soup pass looks
+    at - the entry's text and its first video/channel links - without building
+    a document tree. Completed entries are accumulated in the entries attribute
+    until the caller drains it, so only the entries of the last fed chunk are
+    ever held in memory.
+    """
+
+    def __init__(self, pruned: bool):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self.pruned = pruned  # whether the file was rewritten with prune_html
+        self._depth = 0
+        self._gaps = []
+        self._gap = []
+        self._anchor = None
+        self._anchor_text = None
+        self._watch = None
+        self._channel = None
+
+    def _close_gap(self):
+        gap = ''.join(self._gap)
+        if not gap.strip():
+            gap = '\n'  # lxml collapses blank text between tags
+        elif not self.pruned:
+            # fluff puts each tag on its own line before the BSoup pass, which
+            # surrounds every text node with newlines
+            gap = '\n' + gap + '\n'
+        self._gaps.append(gap)
+        self._gap = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth:
+            self._close_gap()
+            if tag == 'div':
+                self._depth += 1
+            attrs = dict(attrs)
+            href = attrs.get('href')
+            if href is not None and self._anchor is None:
+                if self._watch is None and watch_url_re.search(href):
+                    self._anchor, self._anchor_text = 'watch', [href]
+                elif self._channel is None and channel_url_re.search(href):
+                    self._anchor, self._anchor_text = 'channel', [href]
+        elif tag == 'div':
+            class_ = dict(attrs).get('class') or ''
+            if (class_ == entry_div_class or
+                    'awesome_class' in class_.split()):
+                self._depth = 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self._depth:
+            self._close_gap()
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        self._close_gap()
+        if self._anchor is not None and tag == 'a':
+            href, text = self._anchor_text[0], self._anchor_text[1:]
+            anchor = (href, ''.join(piece.strip() for piece in text))
+            if self._anchor == 'watch':
+                self._watch = anchor
+            else:
+                self._channel = anchor
+            self._anchor = self._anchor_text = None
+        if tag == 'div':
+            self._depth -= 1
+            if not self._depth:
+                self.entries.append((''.join(self._gaps).strip(),
+                                     self._watch, self._channel))
+                self._gaps = []
+                self._watch = self._channel = None
+
+    def handle_data(self, data):
+        if self._depth:
+            self._gap.append(data)
+            if self._anchor is not None:
+                self._anchor_text.append(data)
+
+
+def _is_archive(path: str) -> bool:
+    return path.endswith(zip_extensions + tar_extensions)
+
+
+class _UnseekableReader(io.RawIOBase):
+    """
+    Exposes a tar member read in stream mode, which can't seek or even tell if
+    it can, to io's buffered and text wrappers
+    """
+
+    def __init__(self, member_file):
+        super().__init__()
+        self._member_file = member_file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._member_file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@contextmanager
+def _open_watch_file(watch_file_path: str):
+    """
+    Opens a watch-history file for reading as text, either directly or
+    streamed from within a Takeout archive, without extracting anything.
+
+    Yields the opened file and its name (the archive member's for archives),
+    or (None, None) if the archive has no watch-history file
+    """
+    if watch_file_path.endswith(zip_extensions):
+        with zipfile.ZipFile(watch_file_path) as archive:
+            member = _find_zip_member(archive)
+            if member is None:
+                yield None, None
+            else:
+                with archive.open(member) as watch_file:
+                    yield (io.TextIOWrapper(watch_file, encoding='utf-8'),
+                           member.filename)
+    elif watch_file_path.endswith(tar_extensions):
+        # the stream mode reads the archive front to back only once, the
+        # member has to be consumed before moving past it
+        with tarfile.open(watch_file_path, 'r|gz') as archive:
+            for member in archive:
+                if member.isfile() and archive_member_re.search(member.name):
+                    with archive.extractfile(member) as watch_file:
+                        watch_file = io.BufferedReader(
+                            _UnseekableReader(watch_file))
+                        yield (io.TextIOWrapper(watch_file, encoding='utf-8'),
+                               member.name)
+                    break
+            else:
+                yield None, None
+    else:
+        with open(watch_file_path, 'r', encoding='utf-8') as watch_file:
+            yield watch_file, watch_file_path
+
+
+def _find_zip_member(archive: zipfile.ZipFile):
+    for member in archive.infolist():
+        if archive_member_re.search(member.filename):
+            return member
+
+
+class _UnreadableWatchFile(Exception):
+    """
+    A watch-history file that can't be read, with the reason as
+    _add_failed_file takes it: 'decode' if it (or the archive it's in) can't
+    be read, 'missing' for archives without one
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _iter_streamed_entries(watch_file):
+    """
+    Yields the entries of a watch-history.html file one at a time, reading and
+    parsing it in fixed size chunks.
+    """
+    tail = watch_file.read(len(done_))
+    parser = _WatchHistoryParser(pruned=tail == done_)
+    while True:
+        chunk = watch_file.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk = tail + chunk
+        # normalization can't span a tag's opening bracket, so everything
+        # up to the last one is safe to normalize without the next chunk
+        split_at = chunk.rfind('<')
+        if split_at <= 0:
+            tail = chunk
+            continue
+        tail = chunk[split_at:]
+        parser.feed(unicodedata.normalize('NFKD', chunk[:split_at]))
+        yield from parser.entries
+        parser.entries.clear()
+    parser.feed(unicodedata.normalize('NFKD', tail))
+    parser.close()
+    yield from parser.entries
+
+
+def _iter_soup_entries(content: str):
+    """Yields the entries of an (already read) watch-history.html file"""
+    soup = BSoup(content, 'lxml')
+    for div in soup.find_all('div', class_='awesome_class'):
+        watch, channel = (div.find(href=watch_url_re),
+                          div.find(href=channel_url_re))
+        if watch is not None:
+            watch = (watch['href'], watch.get_text(strip=True))
+        if channel is not None:
+            channel = (channel['href'], channel.get_text(strip=True))
+        yield div.get_text().strip(), watch, channel
+
+
+def _entry_values(all_text: str, watch: tuple, channel: tuple):
+    """
+    Returns the video ID and values (title, channel) of a watch-history entry,
+    or None if it has neither a video link nor a known reason not to have one
+    """
+    default_values = {'timestamps': []}
+    video_id = 'unknown'
+    if (all_text.startswith(removed_string) or
+            all_text.startswith(story_string)):
+        pass
+    elif all_text.startswith('Visited YouTube Music'):
+        video_id = 'youtube_music'
+    else:
+        if watch is None:
+            return
+        url, video_title = watch
+        video_id = extract_video_id_from_url(url)
+        if url != video_title and video_title != 'Deleted video':
+            # Some videos have the url as the title.
+            # They're usually not available through YT or its API
+            default_values['title'] = video_title
+            if channel is not None:
+                channel_url, channel_title = channel
+                channel_id = channel_url[channel_url.rfind('/') + 1:]
+                default_values['channel_id'] = channel_id
+                default_values['channel_title'] = channel_title
+
+    return video_id, default_values
+
+
+def _iter_records(entries, failed_entries: list, epochs=False):
+    """
+    Turns watch-history entries into (video ID, values, timestamp) tuples,
+    with timestamps as epoch seconds instead of datetime objects if epochs is
+    True. Texts of the entries that couldn't be parsed are added to
+    failed_entries.
+    """
+    for all_text, watch, channel in entries:
+        id_and_values = _entry_values(all_text, watch, channel)
+        if id_and_values is None:
+            failed_entries.append(all_text)
+            continue
+
+        watched_at = all_text.splitlines()[-1].strip()
+        try:
+            watched_at = parse_html_timestamp(watched_at, epochs)
+        except ValueError:
+            failed_entries.append(all_text)
+            continue
+
+        yield (*id_and_values, watched_at)
+
+
+def _iter_json_array(json_file):
+    """
+    Decodes the elements of a top level JSON array one at a time, reading the
+    file in fixed size chunks
+    """
+    decoder = json.JSONDecoder()
+    buffer = json_file.read(STREAM_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise json.JSONDecodeError('Expected a JSON array', buffer, 0)
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\n\r,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            element = None
+        if element is None:
+            buffer = buffer[pos:]
+            pos = 0
+            chunk = json_file.read(STREAM_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        pos = end
+        yield element
+
+
+def _iter_json_records(watch_file, failed_entries: list, epochs=False):
+    """
+    Same as _iter_records, but for watch-history.json files. Their timestamps
+    are in UTC rather than local time, duplicates from archives in the other
+    format get caught by the same rule as ones from different timezones.
+    """
+    for entry in _iter_json_array(watch_file):
+        all_text = unicodedata.normalize('NFKD', entry.get('title', ''))
+        watch = channel = None
+        if 'titleUrl' in entry:
+            title = all_text
+            if title.startswith(json_title_prefix):
+                title = title[len(json_title_prefix):]
+            watch = entry['titleUrl'], title
+        if entry.get('subtitles'):
+            subtitle = entry['subtitles'][0]
+            if 'url' in subtitle:
+                channel = (subtitle['url'],
+                           unicodedata.normalize('NFKD',
+                                                 subtitle.get('name', '')))
+
+        id_and_values = _entry_values(all_text, watch, channel)
+        if id_and_values is None:
+            failed_entries.append(json.dumps(entry))
+            continue
+        try:
+            watched_at = parse_json_timestamp(entry['time'], epochs)
+        except (KeyError, ValueError):
+            failed_entries.append(json.dumps(entry))
+            continue
+
+        yield (*id_and_values, watched_at)
+
+
+def _update_values(record: dict, values: dict):
+    for key in values:
+        if key == 'timestamps':
+            continue
+        # checks if the newer record has some data that the one
+        # that's already set doesn't. Sets it if so
+        if not record.get(key, None):
+            record[key] = values[key]
+
+
+def _add_record(videos: dict, video_id: str, default_values: dict,
+                watched_at: datetime):
+    record = videos.setdefault(video_id, default_values)
+    _update_values(record, default_values)
+    timestamp_is_unique_in_list(watched_at, record['timestamps'], insert=True)
+
+
+def _iter_file_records(watch_file_path: str, failed_entries: list,
+                       streaming: bool, prune_html=False, epochs=False):
+    """
+    Yields the records of a watch-history file (see _iter_records). Raises
+    _UnreadableWatchFile if the file turns out to be unreadable, which may
+    only happen after some of its records have been yielded.
+    """
+    try:
+        with _open_watch_file(watch_file_path) as (watch_file, name):
+            if watch_file is None:
+                raise _UnreadableWatchFile('missing')
+            if name.endswith('.json'):
+                yield from _iter_json_records(watch_file, failed_entries,
+                                              epochs)
+                return
+            if streaming:
+                yield from _iter_records(_iter_streamed_entries(watch_file),
+                                         failed_entries, epochs)
+                return
+            content = unicodedata.normalize('NFKD', watch_file.read())
+            original_content = content
+    except (UnicodeDecodeError,) + archive_errors as e:
+        raise _UnreadableWatchFile('decode') from e
+
+    if not content.startswith(done_):  # cleans out all the junk for faster
+        # BSoup parsing, in addition to fixing an out-of-place-tag which
+        # stops BSoup from parsing more than a couple dozen records
+        content = content[content.find('<body>')+6:
+                          content.find('</body>')-6]
+        for piece in fluff:
+            content = content.replace(piece[0], piece[1])
+        content = done_ + '\n' + content
+    if (content != original_content and prune_html and
+            not _is_archive(watch_file_path)):
+        with open(watch_file_path, 'w') as new_file:
+            new_file.write(content)
+        logger.info('Rewrote %s (trimmed junk HTML).', watch_file_path)
+    yield from _iter_records(_iter_soup_entries(content), failed_entries,
+                             epochs)
+
+
+def _add_failed_file(occ_dict: dict, watch_file_path: str, reason: str):
+    if reason == 'missing':
+        # multipart archives only have it in one of the parts
+        logger.warning(f'No watch-history file in {watch_file_path}')
+        return
+    occ_dict['failed_files'].append(watch_file_path)
+    if reason == 'decode':
+        logger.error(f'Failed to decode {watch_file_path}')
+    elif reason == 'malformed':
+        logger.error(f'{watch_file_path} is malformed, only the records '
+                     f'preceding the error were added')
+    else:
+        logger.error(f'Could not find any records in {watch_file_path}.'
+                     f'\nThe file is either corrupt or its format is '
+                     f'different from the expected.')
+
+
+def _new_summary(failed: str = None) -> dict:
+    return {'video_ids': [],
+            'values': [],
+            'codes': array('l'),  # index into video_ids for each timestamp
+            'timestamps': array('q'),
+            'failed_entries': [],
+            'failed': failed}
+
+
+def parse_watch_file(watch_file_path: str, streaming=True) -> dict:
+    """
+    Parses a single watch-history file into a compact summary that can be
+    sent between processes and merged with others via merge_parsed_file.
+
+    Each video's values are merged within the file the same way they are
+    across files, while its timestamps are kept as epoch seconds, in file
+    order and without deduplication, so merging summaries in file order gives
+    the same records as parsing the files one after another.
+    """
+    parsed = _new_summary()
+    records = _iter_file_records(watch_file_path, parsed['failed_entries'],
+                                 streaming, epochs=True)
+
+    codes = {}
+    try:
+        for video_id, values, watched_at in records:
+            del values['timestamps']
+            code = codes.get(video_id)
+            if code is None:
+                code = codes[video_id] = len(parsed['video_ids'])
+                parsed['video_ids'].append(video_id)
+                parsed['values'].append(values)
+            else:
+                _update_values(parsed['values'][code], values)
+            parsed['codes'].append(code)
+            parsed['timestamps'].append(watched_at)
+    except json.JSONDecodeError:
+        parsed['failed'] = 'malformed'
+        return parsed
+    except _UnreadableWatchFile as e:
+        # nothing's taken from unreadable files, even if some was read
+        return _new_summary(e.reason)
+
+    if not parsed['codes'] and not parsed['failed_entries']:
+        parsed['failed'] = 'empty'
+    return parsed
+
+
+def merge_parsed_file(occ_dict: dict, watch_file_path: str, parsed: dict,
+                      since: datetime = None):
+    """
+    Adds the output of parse_watch_file to get_all_records' dict, up to the
+    first record older than since, if it's passed
+    """
+    if parsed['failed']:
+        _add_failed_file(occ_dict, watch_file_path, parsed['failed'])
+        if parsed['failed'] != 'malformed':
+            return
+
+    occ_dict['failed_entries'].extend(parsed['failed_entries'])
+    codes, timestamps = parsed['codes'], parsed['timestamps']
+    if since is not None:
+        since = datetime_to_epoch(since)
+        for ind, timestamp in enumerate(timestamps):
+            if timestamp < since:
+                codes, timestamps = codes[:ind], timestamps[:ind]
+                break
+    occ_dict['total_entries'] += len(codes) + len(parsed['failed_entries'])
+    codes_left = set(codes)
+
+    videos = occ_dict['videos']
+    if isinstance(videos, ColumnarRecords):
+        columnar_codes = [None] * len(parsed['video_ids'])
+        for code, (video_id, values) in enumerate(zip(parsed['video_ids'],
+                                                      parsed['values'])):
+            if code in codes_left:
+                columnar_codes[code] = videos.code_of(video_id)
+                _update_values(videos.values[columnar_codes[code]], values)
+        videos.add_timestamps([columnar_codes[code] for code in codes],
+                              timestamps)
+        return
+
+    for code, (video_id, values) in enumerate(zip(parsed['video_ids'],
+                                                  parsed['values'])):
+        if code not in codes_left:
+            continue
+        if video_id in videos:
+            _update_values(videos[video_id], values)
+        else:
+            videos[video_id] = {'timestamps': [], **values}
+
+    video_ids = parsed['video_ids']
+    for code, timestamp in zip(codes, timestamps):
+        timestamp_is_unique_in_list(epoch_to_datetime(timestamp),
+                                    videos[video_ids[code]]['timestamps'],
+                                    insert=True)
+
+
+def _parse_in_sequence(occ_dict: dict, watch_files: list, streaming: bool,
+                       prune_html: bool, since: datetime = None):
+    watch_files_amount = len(watch_files)
+    for ind, watch_file_path in enumerate(watch_files):
+        yield ind, watch_files_amount
+        failed_entries = []
+        records = _iter_file_records(watch_file_path, failed_entries,
+                                     streaming, prune_html)
+
+        # a file's records are only added once it's been read through, as it
+        # can turn out to be unreadable at any point
+        file_records = []
+        # every entry either becomes a record or gets added to failed ones
+        entries_found = 0
+        malformed = False
+        try:
+            for record in records:
+                entries_found += 1
+                if since is not None and record[2] < since:
+                    records.close()  # the rest is older still
+                    break
+                file_records.append(record)
+        except _UnreadableWatchFile as e:
+            _add_failed_file(occ_dict, watch_file_path, e.reason)
+            continue
+        except json.JSONDecodeError:
+            malformed = True
+        for record in file_records:
+            _add_record(occ_dict['videos'], *record)
+        occ_dict['failed_entries'].extend(failed_entries)
+        if malformed:
+            _add_failed_file(occ_dict, watch_file_path, 'malformed')
+            continue
+        entries_found += len(failed_entries)
+        occ_dict['total_entries'] += entries_found
+
+        if entries_found == 0:
+            _add_failed_file(occ_dict, watch_file_path, 'empty')
+
+
+def _cache_key(watch_file_path: str) -> str:
+    """
+    Identifies a file's parsed records by its contents and the version of the
+    parser that produced them
+    """
+    content_hash = hashlib.sha256()
+    if watch_file_path.endswith(zip_extensions):
+        # zip archives already store a checksum of each member
+        with zipfile.ZipFile(watch_file_path) as archive:
+            member = _find_zip_member(archive)
+        if member is not None:
+            content_hash.update(f'{member.filename} {member.file_size} '
+                                f'{member.CRC}'.encode())
+        return f'{PARSER_VERSION}-zip-{content_hash.hexdigest()}'
+
+    if watch_file_path.endswith(tar_extensions):
+        # gzip streams end with a CRC-32 and the size of the data they hold,
+        # which along with the start of the archive identify it without
+        # decompressing it, so a new archive is only read through once, when
+        # it's parsed
+        with open(watch_file_path, 'rb') as archive:
+            content_hash.update(archive.read(CACHE_HASH_CHUNK_SIZE))
+            archive.seek(-8, os.SEEK_END)
+            content_hash.update(archive.read(8))
+        content_hash.update(
+            f' {os.path.getsize(watch_file_path)}'.encode())
+        return f'{PARSER_VERSION}-tgz-{content_hash.hexdigest()}'
+
+    with open(watch_file_path, 'rb') as watch_file:
+        for chunk in iter(lambda: watch_file.read(CACHE_HASH_CHUNK_SIZE),
+                          b''):
+            content_hash.update(chunk)
+    return f'{PARSER_VERSION}-{content_hash.hexdigest()}'
+
+
+def _load_cached(cache_dir: str, key: str) -> Union[dict, None]:
+    try:
+        with open(join(cache_dir, key + '.bin'), 'rb') as cache_file:
+            return pickle.loads(zlib.decompress(cache_file.read()))
+    except FileNotFoundError:
+        return
+    except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+        logger.warning(f'Discarding unreadable parse cache entry {key} '
+                       f'({e!r})')
+
+
+def _store_in_cache(cache_dir: str, key: str, parsed: dict):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = join(cache_dir, key + '.bin')
+    with open(cache_path + '.tmp', 'wb') as cache_file:
+        cache_file.write(zlib.compress(pickle.dumps(parsed, protocol=4)))
+    os.replace(cache_path + '.tmp', cache_path)
+
+
+def _parse_via_summaries(occ_dict: dict, watch_files: list, streaming: bool,
+                         processes: int, cache_dir: str = None,
+                         since: datetime = None):
+    """
+    Parses the files with parse_watch_file, in separate processes if more
+    than one is allowed, taking the results for unchanged files from
+    cache_dir, if it's passed, and adding the rest to it.
+    """
+    watch_files_amount = len(watch_files)
+    keys = [None] * watch_files_amount
+    summaries = [None] * watch_files_amount
+    if cache_dir:
+        for ind, watch_file_path in enumerate(watch_files):
+            try:
+                keys[ind] = _cache_key(watch_file_path)
+            except archive_errors:
+                continue  # parsing will report it
+            summaries[ind] = _load_cached(cache_dir, keys[ind])
+    to_parse = [ind for ind, summary in enumerate(summaries) if summary is None]
+    if cache_dir:
+        logger.info(f'{watch_files_amount - len(to_parse)} of '
+                    f'{watch_files_amount} watch-history files are unchanged '
+                    f'since they were last parsed')
+
+    executor = None
+    futures = {}
+    if processes > 1 and len(to_parse) > 1:
+        executor = ProcessPoolExecutor(min(processes, len(to_parse)))
+        futures = {executor.submit(parse_watch_file, watch_files[ind],
+                                   streaming): ind
+                   for ind in to_parse}
+        parsed_files = ((futures[future], future.result())
+                        for future in as_completed(futures))
+    else:
+        parsed_files = ((ind, parse_watch_file(watch_files[ind], streaming))
+                        for ind in to_parse)
+
+    try:
+        done = watch_files_amount - len(to_parse)
+        merged = 0
+        while True:
+            if done < watch_files_amount:
+                yield done, watch_files_amount
+            # the order of merging determines which titles and timestamps
+            # are kept, so it has to follow the order of the files
+            while (merged < watch_files_amount and
+                   summaries[merged] is not None):
+                merge_parsed_file(occ_dict, watch_files[merged],
+                                  summaries[merged], since)
+                summaries[merged] = None
+                merged += 1
+            if merged == watch_files_amount:
+                break
+            ind, summary = next(parsed_files)
+            if keys[ind]:
+                _store_in_cache(cache_dir, keys[ind], summary)
+            summaries[ind] = summary
+            done += 1
+    finally:
+        if executor:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+
 def get_all_records(takeout_path: str = '.',
                     dump_json_to_dir: str = None, prune_html=False,
-                    verbose=True) -> Union[dict, bool]:
+                    verbose=True, streaming=False,
+                    processes: int = 1,
+                    cache_dir: str = None,
+                    since: datetime = None,
+                    columnar=False) -> Union[dict, bool]:
     """
-    Accumulates records from all found watch-history.html files and returns
-    them in a dict.
+    Accumulates records from all found watch-history.html/.json files and
+    returns them in a dict.
 
     :param takeout_path: directory containing Takeout directories or
-    watch-history.html files, or a path to one of those files directly
+    watch-history files, or a path to one of those files directly
     :param dump_json_to_dir: saves the dict with accumulated records to a
     json file
     :param prune_html: prunes HTML that doesn't allow or slows down the
-    processing of files with Beautiful Soup
+    processing of files with Beautiful Soup. Has no effect when streaming or
+    using multiple processes
     :param verbose:
+    :param streaming: parse HTML files incrementally, entry by entry, instead
+    of loading each of them into Beautiful Soup whole (JSON files are always
+    parsed that way). Memory use doesn't grow with the size of the files, the
+    output is the same
+    :param processes: parse up to this many files at once, each in its own
+    process. No more processes are started than there are files, and none
+    for a single file. Progress is then reported as files finish, in any
+    order
+    :param cache_dir: directory for keeping the parsed records of each file,
+    keyed by its contents. Files that were parsed before aren't parsed again
+    :param since: only take records up to the first one older than this from
+    each file. Watch-history files list the newest entries first, so when
+    importing a newer Takeout on top of older ones this skips what's already
+    in the database, parsing is stopped as soon as it's reached (unless the
+    file goes through the cache)
+    :param columnar: return the records as ColumnarRecords, which keep the
+    timestamps in NumPy arrays rather than lists of datetime objects. Files
+    are then always parsed via parse_watch_file
     :return:
     """
 
@@ -148,125 +898,50 @@ def get_all_records(takeout_path: str = '.',
     if not watch_files:
         logger.warning('Found no watch-history files.')
         return {}
+    processes = min(processes, len(watch_files))
 
     occ_dict = {'videos': {'unknown': {'timestamps': []}},
                 'failed_entries': [],
-                'failed_files': []}
-
-    failed_entries = 0
+                'failed_files': [],
+                'total_entries': 0}
+
+    if columnar:
+        occ_dict['videos'] = ColumnarRecords()
+
+    if columnar or cache_dir or (processes > 1 and len(watch_files) > 1):
+        yield from _parse_via_summaries(occ_dict, watch_files, streaming,
+                                        processes, cache_dir, since)
+    else:
+        yield from _parse_in_sequence(occ_dict, watch_files, streaming,
+                                      prune_html, since)
+
+    if columnar:
+        occ_dict['videos'].finalize()
+        unk_timestamps = occ_dict['videos'].timestamps_of('unknown')
+        total_timestamps = occ_dict['videos'].timestamps_amount
+    else:
+        all_known_timestamps_ids = list(occ_dict['videos'].keys())
+        all_known_timestamps_ids.remove('unknown')
+        all_known_timestamps_lists = [i for i in
+                                      [occ_dict['videos'][v_id]['timestamps']
+                                       for v_id in all_known_timestamps_ids]]
+        all_known_timestamps = list(itertools.chain.from_iterable(
+            all_known_timestamps_lists))
+        unk_timestamps = occ_dict['videos']['unknown']['timestamps']
+        unk_timestamps = sorted(
+            list(set(unk_timestamps).difference(all_known_timestamps)))
+        unk_timestamps = to_datetimes(remove_duplicates(
+            to_epochs(all_known_timestamps), to_epochs(unk_timestamps)))
+        occ_dict['videos']['unknown']['timestamps'] = unk_timestamps
+        total_timestamps = len(all_known_timestamps + unk_timestamps)
 
-    def add_failed_parse_entry_to_list(div_text):
-        nonlocal failed_entries
-        occ_dict['failed_entries'].append(div_text)
-        failed_entries += 1
-
-    watch_files_amount = len(watch_files)
-    for ind, watch_file_path in enumerate(watch_files):
-        yield ind, watch_files_amount
-        try:
-            with open(watch_file_path, 'r', encoding='utf-8') as watch_file:
-                content = unicodedata.normalize('NFKD', watch_file.read())
-                original_content = content
-        except UnicodeDecodeError:
-            occ_dict['failed_files'].append(watch_file_path)
-            logger.error(f'Failed to decode {watch_file_path}')
-            continue
-        if not content.startswith(done_):  # cleans out all the junk for faster
-            # BSoup parsing, in addition to fixing an out-of-place-tag which
-            # stops BSoup from parsing more than a couple dozen records
-            content = content[content.find('<body>')+6:
-                              content.find('</body>')-6]
-            for piece in fluff:
-                content = content.replace(piece[0], piece[1])
-            content = done_ + '\n' + content
-        if content != original_content and prune_html:
-            with open(watch_file_path, 'w') as new_file:
-                new_file.write(content)
-            logger.info('Rewrote', watch_file_path, '(trimmed junk HTML).')
-
-        soup = BSoup(content, 'lxml')
-        divs = soup.find_all('div', class_='awesome_class')
-
-        if len(divs) == 0:
-            occ_dict['failed_files'].append(watch_file_path)
-            logger.error(f'Could not find any records in {watch_file_path}.'
-                         f'\nThe file is either corrupt or its format is '
-                         f'different from the expected.')
-            continue
-        for div in divs:
-            default_values = {'timestamps': []}
-            video_id = 'unknown'
-            all_text = div.get_text().strip()
-            watched_at = all_text.splitlines()[-1].strip()
-
-            if (all_text.startswith(removed_string) or
-                    all_text.startswith(story_string)):
-                pass
-            elif all_text.startswith('Visited YouTube Music'):
-                video_id = 'youtube_music'
-            else:
-                url = div.find(href=watch_url_re)
-                if url is None:
-                    add_failed_parse_entry_to_list(all_text)
-                    continue
-                video_id = extract_video_id_from_url(url['href'])
-                video_title = url.get_text(strip=True)
-                if (url['href'] != video_title and 
-                        video_title != 'Deleted video'):
-                    # Some videos have the url as the title.
-                    # They're usually not available through YT or its API
-                    default_values['title'] = video_title
-                    try:
-                        channel = div.find(href=channel_url_re)
-                        channel_url = channel['href']
-                        channel_id = channel_url[channel_url.rfind('/') + 1:]
-                        channel_title = channel.get_text(strip=True)
-                        default_values['channel_id'] = channel_id
-                        default_values['channel_title'] = channel_title
-                    except TypeError:
-                        pass
-
-            try:
-                watched_at = datetime.strptime(
-                    watched_at[:watched_at.rfind(' ')],
-                    '%b %d, %Y, %I:%M:%S %p')
-            except ValueError:
-                add_failed_parse_entry_to_list(all_text)
-                continue
-
-            occ_dict['videos'].setdefault(video_id, default_values)
-            default_keys = list(default_values.keys())
-            default_keys.remove('timestamps')
-            for key in default_keys:
-                # checks if the newer record has some data that the one
-                # that's already set doesn't. Sets it if so
-                if not occ_dict['videos'][video_id].get(key, None):
-                    occ_dict['videos'][video_id][key] = default_values[key]
-
-            cur_timestamps = occ_dict['videos'][video_id]['timestamps']
-            timestamp_is_unique_in_list(watched_at, cur_timestamps, insert=True)
-
-    all_known_timestamps_ids = list(occ_dict['videos'].keys())
-    all_known_timestamps_ids.remove('unknown')
-    all_known_timestamps_lists = [i for i in
-                                  [occ_dict['videos'][v_id]['timestamps']
-                                   for v_id in all_known_timestamps_ids]]
-    all_known_timestamps = list(itertools.chain.from_iterable(
-        all_known_timestamps_lists))
-    unk_timestamps = occ_dict['videos']['unknown']['timestamps']
-    unk_timestamps = sorted(
-        list(set(unk_timestamps).difference(all_known_timestamps)))
-    occ_dict['videos']['unknown']['timestamps'] = unk_timestamps
-    remove_timestamps_from_one_list_from_another(all_known_timestamps,
-                                                 unk_timestamps)
-
-    total_timestamps = len(all_known_timestamps + unk_timestamps)
     total_videos = len(occ_dict["videos"]) - 1  # minus one for 'unknown' key
 
     occ_dict['total_timestamps'] = total_timestamps
     occ_dict['total_videos'] = total_videos
 
-    if occ_dict['failed_entries']:
+    failed_entries = len(occ_dict['failed_entries'])
+    if failed_entries:
         logger.error(f'''Could not parse {failed_entries} entries from 
         Takeout. ''')
 
@@ -276,11 +951,13 @@ def get_all_records(takeout_path: str = '.',
         Total unknown videos: {len(unk_timestamps)})
         Unique videos with ids: {total_videos}''')
     if dump_json_to_dir:
-        import json
         with open(
                 join(dump_json_to_dir, 'parsed_watch_history.json'),
                 'w') as all_records_file:
-            json.dump(occ_dict['videos'], all_records_file, indent=4,
+            videos = occ_dict['videos']
+            if columnar:
+                videos = videos.to_dict()
+            json.dump(videos, all_records_file, indent=4,
                       default=lambda o: str(o))  # for dt objects
             if failed_entries or occ_dict['failed_files']:
                 fails = {'failed_files': occ_dict['failed_files'],
@@ -0,0 +1,222 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+from httplib2 import Response
+
+from youtubewatched import youtube
+from youtubewatched.topics import topics
+
+"""
+A stand-in for the YouTube Data API, served through an injected HTTP
+transport instead of the network, so the import/update pipeline can be
+benchmarked and tried out reproducibly and without spending quota.
+
+Videos are made up from their IDs: the same ID always gets the same
+response, whatever the ID is.
+"""
+
+CATEGORIES = {'1': 'Film & Animation', '2': 'Autos & Vehicles',
+              '10': 'Music', '15': 'Pets & Animals', '17': 'Sports',
+              '20': 'Gaming', '22': 'People & Blogs', '23': 'Comedy',
+              '24': 'Entertainment', '25': 'News & Politics',
+              '26': 'Howto & Style', '27': 'Education',
+              '28': 'Science & Technology'}
+TOPIC_IDS = sorted(topics)
+
+
+def _error(status: int, reason: str, message: str):
+    content = {'error': {'errors': [{'domain': 'youtube.quota',
+                                     'reason': reason,
+                                     'message': message}],
+                         'code': status, 'message': message}}
+    return (Response({'status': status, 'content-type': 'application/json'}),
+            json.dumps(content).encode())
+
+
+class FakeYouTubeApi:
+    """
+    Serves videos.list and videoCategories.list, 1 quota unit per request.
+    Once quota units are spent, requests fail with quotaExceeded.
+
+    :param latency: seconds each request takes
+    :param error_rate: share of requests that fail with a server error
+    :param rate_limit_rate: share of requests that fail with rateLimitExceeded
+    :param missing_rate: share of videos that aren't available (no items)
+    :param quota: units the API serves before failing with quotaExceeded,
+    None for no limit
+    :param seed: the errors are random, but repeat for the same seed
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, missing_rate: float = 0.05,
+                 quota: int = None, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.missing_rate = missing_rate
+        self.quota = quota
+        self.units_spent = 0
+        self.requests = 0
+        self.errors = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def http(self):
+        """Returns a transport to build the API client or HttpPool with"""
+        return FakeHttp(self)
+
+    def video(self, video_id: str) -> dict:
+        """Returns the video's resource, as the API would with fields"""
+        rand = random.Random(zlib.crc32(video_id.encode()))
+        if rand.random() < self.missing_rate:
+            return None
+        channel_number = rand.randrange(1000)
+        published = (f'20{rand.randrange(6, 20):02}-'
+                     f'{rand.randrange(1, 13):02}-{rand.randrange(1, 29):02}T'
+                     f'{rand.randrange(24):02}:{rand.randrange(60):02}:'
+                     f'{rand.randrange(60):02}.000Z')
+        video = {
+            'id': video_id,
+            'etag': f'"{zlib.crc32(video_id.encode() + b"etag"):x}"',
+            'snippet': {
+                'publishedAt': published,
+                'channelId': f'UCfake{channel_number:06}',
+                'title': f'Video {video_id}',
+                'description': f'Description of {video_id}. ' *
+                               rand.randrange(1, 20),
+                'channelTitle': f'Channel {channel_number}',
+                'tags': [f'tag{number}' for number in
+                         rand.sample(range(5000), rand.randrange(15))],
+                'categoryId': rand.choice(list(CATEGORIES))},
+            'contentDetails': {
+                'duration': f'PT{rand.randrange(60)}M{rand.randrange(60)}S'},
+            'statistics': {
+                'viewCount': str(rand.randrange(10 ** 7)),
+                'likeCount': str(rand.randrange(10 ** 5)),
+                'dislikeCount': str(rand.randrange(10 ** 4)),
+                'commentCount': str(rand.randrange(10 ** 4))},
+            'topicDetails': {
+                'relevantTopicIds': rand.sample(TOPIC_IDS,
+                                                rand.randrange(4))}}
+        if rand.random() < 0.05:
+            video['liveStreamingDetails'] = {'actualStartTime': published}
+        return video
+
+    def _videos_list(self, params: dict) -> dict:
+        ids = params['id'][0].split(',')[:youtube.MAX_IDS_PER_REQUEST]
+        videos = (self.video(video_id) for video_id in ids)
+        return {'kind': 'youtube#videoListResponse',
+                'items': [video for video in videos if video]}
+
+    @staticmethod
+    def _categories_list() -> dict:
+        return {'kind': 'youtube#videoCategoryListResponse',
+                'items': [{'id': id_, 'etag': f'"category{id_}"',
+                           'snippet': {'channelId': 'UCBR8-60-B28hp2BmDPdntcQ',
+                                       'title': title, 'assignable': True}}
+                          for id_, title in CATEGORIES.items()]}
+
+    def request(self, uri: str):
+        time.sleep(self.latency)
+        url = urlsplit(uri)
+        method = url.path.rstrip('/').rsplit('/', 1)[-1]
+        with self.lock:
+            self.requests += 1
+            if self.quota is not None and self.units_spent >= self.quota:
+                self.errors += 1
+                return _error(403, 'quotaExceeded',
+                              'The request cannot be completed because you '
+                              'have exceeded your quota.')
+            draw = self.random.random()
+            if draw < self.error_rate:
+                self.errors += 1
+                return _error(503, 'backendError', 'Backend Error')
+            if draw < self.error_rate + self.rate_limit_rate:
+                self.errors += 1
+                return _error(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+            self.units_spent += 1
+        if method == 'videos':
+            content = self._videos_list(parse_qs(url.query))
+        elif method == 'videoCategories':
+            content = self._categories_list()
+        else:
+            return _error(404, 'notFound', f'Unknown method {method!r}')
+        return (Response({'status': 200,
+                          'content-type': 'application/json'}),
+                json.dumps(content).encode())
+
+
+class FakeHttp:
+    """An httplib2.Http stand-in that passes requests to a FakeYouTubeApi"""
+
+    def __init__(self, api: FakeYouTubeApi):
+        self.api = api
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        return self.api.request(uri)
+
+
+@contextmanager
+def installed(api: FakeYouTubeApi):
+    """
+    Makes the API requests go to api instead of the network for the
+    duration, yields the API client to pass to insert_videos/update_videos
+    """
+    real_pool = youtube.http_pool
+    youtube.http_pool = youtube.HttpPool(api.http)
+    try:
+        yield youtube.get_api_auth('fake-api-key', http=api.http())
+    finally:
+        youtube.http_pool = real_pool
+
+
+def make_records(amount: int, timestamps_per_video: int = 3,
+                 seed: int = 0) -> dict:
+    """Returns amount made up Takeout records, as insert_videos takes them"""
+    rand = random.Random(seed)
+    start = datetime(2015, 1, 1)
+    records = {}
+    for number in range(amount):
+        video_id = f'fake{number:07}'
+        records[video_id] = {
+            'timestamps': sorted(
+                start + timedelta(seconds=rand.randrange(10 ** 8))
+                for _ in range(rand.randrange(1, timestamps_per_video + 1))),
+            'title': f'Video {video_id}'}
+    return records
+
+
+def add_existing_videos(conn: sqlite3.Connection, amount: int,
+                        seed: int = 0):
+    """
+    Inserts amount made up videos, with a timestamp each, straight into the
+    database, as if they'd been imported before (no API requests). 1 in 20
+    of them is also added to dead_videos_ids. They're marked deleted, so
+    updating records leaves them be.
+    """
+    rand = random.Random(seed)
+    start = datetime(2015, 1, 1)
+    conn.execute('INSERT OR IGNORE INTO channels (id, title) '
+                 'VALUES (?, ?);', ('UCexisting', 'Existing channel'))
+    video_ids = [f'existing{number:07}' for number in range(amount)]
+    conn.executemany('INSERT OR IGNORE INTO videos '
+                     '(id, channel_id, title, status, last_updated) '
+                     'VALUES (?, ?, ?, ?, ?);',
+                     [(video_id, 'UCexisting', f'Video {video_id}', 'deleted',
+                       str(start)) for video_id in video_ids])
+    conn.executemany('INSERT OR IGNORE INTO videos_timestamps '
+                     '(video_id, watched_at) VALUES (?, ?);',
+                     [(video_id,
+                       str(start + timedelta(seconds=rand.randrange(10 ** 8))))
+                      for video_id in video_ids])
+    conn.executemany('INSERT OR IGNORE INTO dead_videos_ids (id) VALUES (?);',
+                     [(video_id,) for video_id in video_ids[::20]])
+    conn.commit()
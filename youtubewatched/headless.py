@@ -0,0 +1,374 @@
+import logging
+import os
+import sqlite3
+import statistics
+import time
+from collections import Counter
+from datetime import datetime
+from functools import partial
+from os.path import join
+
+from googleapiclient.http import build_http
+
+from youtubewatched import tag_cache
+from youtubewatched import write_to_sql
+from youtubewatched import youtube
+from youtubewatched.api_cache import ApiResponseCache, open_api_cache
+from youtubewatched.quota import QuotaAccount, estimate_units
+from youtubewatched.config import (DB_NAME, PARSE_CACHE_DIR,
+                                   MAX_TIME_DIFFERENCE, API_CONCURRENCY)
+from youtubewatched.convert_takeout import get_all_records
+from youtubewatched.utils.gen import load_file
+from youtubewatched.utils import takeout_time
+from youtubewatched.utils.sql import sqlite_connection
+
+"""
+Takeout import and record updates without the web interface, for the CLI
+commands. Nothing here imports Flask, Dash or pandas. Both functions return
+throughput statistics for the run.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _rate(amount: int, seconds: float) -> float:
+    return round(amount / seconds, 1) if seconds else 0.0
+
+
+def _api_requests_made() -> int:
+    return sum(youtube.request_counts.values())
+
+
+def _api_retries_made() -> Counter:
+    return Counter(youtube.retry_counts)
+
+
+def _tag_lookups_made() -> Counter:
+    return Counter(tag_cache.lookup_counts)
+
+
+def _latency_stats(seconds: list) -> dict:
+    return {'min_ms': round(min(seconds) * 1000, 1),
+            'median_ms': round(statistics.median(seconds) * 1000, 1),
+            'max_ms': round(max(seconds) * 1000, 1)}
+
+
+def _run(run, conn, quota: QuotaAccount, wait_for_quota: bool):
+    if wait_for_quota:
+        return write_to_sql.run_until_done(run, conn, quota)
+    return run()
+
+
+def import_takeout(takeout_path: str, project_path: str = '.',
+                   verbosity: int = 1, full_reconcile=False,
+                   concurrency: int = API_CONCURRENCY,
+                   api_cache_path: str = None, budget: int = None,
+                   wait_for_quota=True) -> dict:
+    """
+    Same as adding Takeout from the web interface: parses the watch-history
+    files in takeout_path and inserts the records into the project's
+    database, querying the API for new videos.
+
+    :param full_reconcile: process all entries, not just the ones newer than
+    what's already in the database
+    :param concurrency: API requests made at once
+    :param api_cache_path: API response cache to use instead of the
+    project's own (see api_cache.open_api_cache)
+    :param budget: daily API quota budget to use instead of the project's
+    :param wait_for_quota: once the quota (or budget) runs out, wait for it
+    to reset and continue, instead of stopping
+    """
+    db_path = join(project_path, DB_NAME)
+    since = None
+    if not full_reconcile and os.path.exists(db_path):
+        conn = sqlite_connection(db_path, types=True)
+        watermark = write_to_sql.get_watermark(conn)
+        conn.close()
+        if watermark:
+            since = watermark - MAX_TIME_DIFFERENCE
+            logger.info(f'Only processing entries from {since} onward')
+
+    parse_start = time.perf_counter()
+    parsed = None
+    for parsed in get_all_records(takeout_path, project_path,
+                                  verbose=verbosity >= 1, streaming=True,
+                                  processes=os.cpu_count() or 1,
+                                  cache_dir=join(project_path,
+                                                 PARSE_CACHE_DIR),
+                                  since=since, columnar=True):
+        pass
+    parse_seconds = time.perf_counter() - parse_start
+    if not isinstance(parsed, dict):
+        raise FileNotFoundError(f'No watch-history files found in '
+                                f'{takeout_path!r}')
+
+    stats = {'entries': parsed['total_entries'],
+             'failed_entries': len(parsed['failed_entries']),
+             'failed_files': parsed['failed_files'],
+             'parse_seconds': round(parse_seconds, 2),
+             'entries_per_second': _rate(parsed['total_entries'],
+                                         parse_seconds)}
+
+    conn = sqlite_connection(db_path, types=True)
+    api_cache = open_api_cache(project_path, api_cache_path)
+    quota = write_to_sql.open_quota_account(conn, budget)
+    units_at_start = quota.spent
+    try:
+        api_auth = youtube.get_api_auth(
+            load_file(join(project_path, 'api_key')).strip())
+        requests_at_start = _api_requests_made()
+        retries_at_start = _api_retries_made()
+        tag_lookups_at_start = _tag_lookups_made()
+        changes_at_start = conn.total_changes
+        insert_start = time.perf_counter()
+        write_to_sql.setup_tables(conn, api_auth, quota)
+        insert = partial(write_to_sql.insert_videos, conn, parsed['videos'],
+                         api_auth, verbosity, since, concurrency,
+                         api_cache=api_cache, quota=quota)
+        for _ in _run(insert, conn, quota, wait_for_quota):
+            pass
+        insert_seconds = time.perf_counter() - insert_start
+        stats.update(_db_stats(conn, api_cache, quota, units_at_start,
+                               insert_seconds,
+                               _api_requests_made() - requests_at_start,
+                               _api_retries_made() - retries_at_start,
+                               _tag_lookups_made() - tag_lookups_at_start,
+                               conn.total_changes - changes_at_start))
+    finally:
+        api_cache.close()
+        conn.close()
+    return stats
+
+
+def update_records(project_path: str = '.', cutoff: int = 172800,
+                   verbosity: int = 1,
+                   concurrency: int = API_CONCURRENCY,
+                   api_cache_path: str = None, budget: int = None,
+                   wait_for_quota=True) -> dict:
+    """
+    Same as updating records from the web interface: re-queries the API for
+    videos that were last updated more than cutoff seconds ago.
+    """
+    conn = sqlite_connection(join(project_path, DB_NAME))
+    api_cache = open_api_cache(project_path, api_cache_path)
+    quota = write_to_sql.open_quota_account(conn, budget)
+    units_at_start = quota.spent
+    try:
+        api_auth = youtube.get_api_auth(
+            load_file(join(project_path, 'api_key')).strip())
+        requests_at_start = _api_requests_made()
+        retries_at_start = _api_retries_made()
+        tag_lookups_at_start = _tag_lookups_made()
+        changes_at_start = conn.total_changes
+        update_start = time.perf_counter()
+        update = partial(write_to_sql.update_videos, conn, api_auth, cutoff,
+                         verbosity, concurrency, api_cache=api_cache,
+                         quota=quota)
+        progress = None
+        for progress in _run(update, conn, quota, wait_for_quota):
+            pass
+        update_seconds = time.perf_counter() - update_start
+        stats = _db_stats(conn, api_cache, quota, units_at_start,
+                          update_seconds,
+                          _api_requests_made() - requests_at_start,
+                          _api_retries_made() - retries_at_start,
+                          _tag_lookups_made() - tag_lookups_at_start,
+                          conn.total_changes - changes_at_start)
+        stats['records_updated'] = progress[2] if progress else 0
+        stats['records_unchanged'] = progress[6] if progress else 0
+        return stats
+    finally:
+        api_cache.close()
+        conn.close()
+
+
+def quota_status(project_path: str = '.', cutoff: int = 172800,
+                 budget: int = None) -> dict:
+    """
+    Returns the API quota spent by the project today, its daily budget and
+    how much of it updating records older than cutoff seconds would take.
+    Sets the daily budget first if it's passed (0 for the full quota).
+    """
+    conn = sqlite_connection(join(project_path, DB_NAME))
+    try:
+        if budget is not None:
+            write_to_sql.set_quota_budget(conn, budget)
+        quota = write_to_sql.open_quota_account(conn)
+        try:
+            to_update = len(write_to_sql.get_records_to_update(conn, cutoff))
+        except sqlite3.OperationalError:
+            to_update = 0  # no records yet
+        return {'day': quota.day,
+                'usage': quota.usage(),
+                'spent': quota.spent,
+                'budget': quota.budget,
+                'remaining': quota.remaining,
+                'records_to_update': to_update,
+                'update_units': estimate_units(to_update)}
+    finally:
+        conn.close()
+
+
+def benchmark_api(project_path: str = '.', calls: int = 5) -> dict:
+    """
+    Times building the API client from the bundled discovery document and
+    from the fetched one, and making calls calls (videoCategories.list, 1
+    quota unit each) with a pooled keep-alive connection and with a new
+    connection each. Charges the calls to the project's quota.
+    """
+    conn = sqlite_connection(join(project_path, DB_NAME))
+    quota = write_to_sql.open_quota_account(conn)
+    try:
+        api_key = load_file(join(project_path, 'api_key')).strip()
+        start = time.perf_counter()
+        api_auth = youtube.get_api_auth(api_key)
+        bundled_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        youtube.get_api_auth(api_key, fetch_discovery=True)
+        fetched_seconds = time.perf_counter() - start
+
+        def time_calls(get_http) -> list:
+            seconds = []
+            for _ in range(calls):
+                if not quota.reserve('videoCategories.list'):
+                    break
+                http = get_http()
+                start_ = time.perf_counter()
+                youtube.get_categories(api_auth, http)
+                seconds.append(time.perf_counter() - start_)
+            return seconds
+
+        with youtube.http_pool.connection() as pooled_http:
+            quota.reserve('videoCategories.list')
+            youtube.get_categories(api_auth, pooled_http)  # connects
+            pooled = time_calls(lambda: pooled_http)
+        new = time_calls(build_http)
+        stats = {'startup_bundled_ms': round(bundled_seconds * 1000, 1),
+                 'startup_fetched_ms': round(fetched_seconds * 1000, 1),
+                 'quota_exhausted': quota.exhausted}
+        if pooled and new:
+            stats['pooled_calls'] = _latency_stats(pooled)
+            stats['new_connection_calls'] = _latency_stats(new)
+        return stats
+    finally:
+        quota.save()
+        conn.commit()
+        conn.close()
+
+
+def benchmark_pipeline(videos: int = 2000,
+                       concurrency: int = API_CONCURRENCY,
+                       latency: float = 0.05, error_rate: float = 0.0,
+                       rate_limit_rate: float = 0.0, quota: int = None,
+                       seed: int = 0, existing: int = 0) -> dict:
+    """
+    Inserts videos made up records into a new database in a temporary
+    directory and then updates them all, with the API requests going to a
+    fake_api.FakeYouTubeApi with the given latency, error rates and quota.
+    Returns the stats of both runs, as import_takeout/update_records do.
+
+    :param existing: videos the database has before the import (see
+    fake_api.add_existing_videos), to see how the import scales with its
+    size; the update leaves them out
+    """
+    from tempfile import TemporaryDirectory
+    from youtubewatched.fake_api import (FakeYouTubeApi, installed,
+                                         make_records, add_existing_videos)
+
+    api = FakeYouTubeApi(latency, error_rate, rate_limit_rate, quota=quota,
+                         seed=seed)
+    stats = {}
+    with TemporaryDirectory() as project_path, installed(api) as api_auth:
+        conn = sqlite_connection(join(project_path, DB_NAME))
+        api_cache = ApiResponseCache(join(project_path, 'api_cache.sqlite'))
+        # the fake API's quota is the only limit
+        quota_account = write_to_sql.open_quota_account(conn, 10 ** 9)
+        try:
+            write_to_sql.setup_tables(conn, api_auth, quota_account)
+            add_existing_videos(conn, existing, seed)
+            # a cutoff of -1 updates all the records, including ones inserted
+            # within the same second, and takes none of them from the cache
+            runs = {'import': partial(write_to_sql.insert_videos, conn,
+                                      make_records(videos, seed=seed),
+                                      api_auth, 0, concurrency=concurrency),
+                    'update': partial(write_to_sql.update_videos, conn,
+                                      api_auth, -1, 0, concurrency)}
+            for name, run in runs.items():
+                units_at_start = quota_account.spent
+                requests_at_start = _api_requests_made()
+                retries_at_start = _api_retries_made()
+                tag_lookups_at_start = _tag_lookups_made()
+                changes_at_start = conn.total_changes
+                api_cache.hits = api_cache.misses = 0
+                start = time.perf_counter()
+                try:
+                    for _ in run(api_cache=api_cache, quota=quota_account):
+                        pass
+                except youtube.ApiQuotaError as e:
+                    logger.warning(f'{name}: {e}')
+                seconds = time.perf_counter() - start
+                stats[name] = _db_stats(
+                    conn, api_cache, quota_account, units_at_start, seconds,
+                    _api_requests_made() - requests_at_start,
+                    _api_retries_made() - retries_at_start,
+                    _tag_lookups_made() - tag_lookups_at_start,
+                    conn.total_changes - changes_at_start)
+        finally:
+            api_cache.close()
+            conn.close()
+    stats['fake_api'] = {'requests': api.requests, 'errors': api.errors,
+                         'units_spent': api.units_spent}
+    return stats
+
+
+def benchmark_timestamps(amount: int = 300000, seed: int = 0) -> dict:
+    """
+    Times parsing amount made up Takeout timestamps of each format with
+    utils.takeout_time and with the strptime calls it replaced
+    """
+    html, json_ = takeout_time.made_up_timestamps(amount, seed)
+    runs = {
+        'html': (takeout_time.parse_html_timestamp,
+                 lambda text: datetime.strptime(text[:text.rfind(' ')],
+                                                takeout_time.HTML_FORMAT),
+                 html),
+        'json': (takeout_time.parse_json_timestamp,
+                 lambda text: datetime.strptime(text[:19],
+                                                takeout_time.JSON_FORMAT),
+                 json_)}
+    stats = {}
+    for name, (parse, parse_with_strptime, timestamps) in runs.items():
+        takeout_time._parse_date.cache_clear()
+        seconds = {}
+        for kind, function in [('fast', parse),
+                               ('strptime', parse_with_strptime)]:
+            start = time.perf_counter()
+            for timestamp in timestamps:
+                function(timestamp)
+            seconds[kind] = time.perf_counter() - start
+        stats[name] = {'fast_seconds': round(seconds['fast'], 2),
+                       'strptime_seconds': round(seconds['strptime'], 2),
+                       'speedup': round(seconds['strptime'] / seconds['fast'],
+                                        1)}
+    return stats
+
+
+def _db_stats(conn, api_cache: ApiResponseCache, quota: QuotaAccount,
+              units_at_start: int, seconds: float, api_requests: int,
+              api_retries: Counter, tag_lookups: Counter,
+              rows: int) -> dict:
+    return {'db_seconds': round(seconds, 2),
+            'api_cache_hits': api_cache.hits,
+            'api_cache_misses': api_cache.misses,
+            'quota_units_spent': quota.spent - units_at_start,
+            'quota_remaining': quota.remaining,
+            'quota_exhausted': quota.exhausted,
+            'api_requests': api_requests,
+            'api_requests_per_second': _rate(api_requests, seconds),
+            'api_retries': dict(api_retries),
+            'tag_cache_hits': tag_lookups['hits'],
+            'tag_cache_misses': tag_lookups['misses'],
+            'rows_written': rows,
+            'rows_per_second': _rate(rows, seconds),
+            'records_in_db': conn.execute(
+                'SELECT count(*) FROM videos').fetchone()[0]}
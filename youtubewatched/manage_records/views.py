@@ -2,6 +2,8 @@ import json
 import logging
 import os
 import sqlite3
+from datetime import datetime, timezone
+from functools import partial
 from os.path import join
 from threading import Thread
 from time import sleep
@@ -11,8 +13,10 @@ from flask import (Response, Blueprint, request, redirect, make_response,
                    render_template, url_for, flash)
 
 from youtubewatched import write_to_sql
+from youtubewatched.api_cache import open_api_cache
 from youtubewatched import youtube
-from youtubewatched.config import DB_NAME
+from youtubewatched.config import (DB_NAME, PARSE_CACHE_DIR,
+                                   MAX_TIME_DIFFERENCE)
 from youtubewatched.convert_takeout import get_all_records
 from youtubewatched.utils.app import (get_project_dir_path_from_cookie,
                                       flash_err, strong)
@@ -187,7 +191,8 @@ def start_db_process():
         takeout_dir = os.path.expanduser(takeout_path.strip())
         if os.path.exists(takeout_dir):
             resp.set_cookie(takeout_dir_cookie, takeout_dir, max_age=31_536_000)
-        args = (takeout_dir, project_path, logging_verbosity)
+        full_reconcile = request.form.get('full-reconcile') == 'true'
+        args = (takeout_dir, project_path, logging_verbosity, full_reconcile)
         target = populate_db
     else:
         cutoff_time = request.form.get('update-cutoff')
@@ -223,19 +228,51 @@ def _show_front_end_data(fe_data: dict, conn):
     add_sse_event(json.dumps(fe_data), 'stats')
 
 
-def populate_db(takeout_path: str, project_path: str, logging_verbosity: int):
+def _announce_quota_wait(reset: datetime):
+    local_reset = reset.replace(tzinfo=timezone.utc).astimezone()
+    add_sse_event(f'API quota used up for today, continuing automatically at '
+                  f'{local_reset:%Y-%m-%d %H:%M} (when it resets); cancel to '
+                  f'stop here instead', 'info')
+
+
+def _quota_budget_message(quota) -> str:
+    return (f'Stopped early, as the daily API quota budget '
+            f'({quota.budget} units) has been used up. The rest can be '
+            f'processed once it resets, at midnight Pacific time')
+
+
+def populate_db(takeout_path: str, project_path: str, logging_verbosity: int,
+                full_reconcile: bool = False):
 
     if DBProcessState.exit_thread_check():
         return
 
     progress.clear()
 
+    db_path = join(project_path, DB_NAME)
+    since = None
+    if not full_reconcile and os.path.exists(db_path):
+        conn = sqlite_connection(db_path, types=True)
+        watermark = write_to_sql.get_watermark(conn)
+        conn.close()
+        if watermark:
+            # entries up to a day older than the newest one in the DB may be
+            # it in a different timezone, so they still go through dedupe
+            since = watermark - MAX_TIME_DIFFERENCE
+            add_sse_event(f'Only processing entries from {since} onward; '
+                          f'use full reconcile for older archives', 'info')
+
     DBProcessState.percent = '0'
     DBProcessState.stage = 'Processing watch-history.html file(s)...'
     add_sse_event(DBProcessState.stage, 'stage')
     records = {}
     try:
-        for f in get_all_records(takeout_path, project_path):
+        # a process per file at most, and none for a single file
+        for f in get_all_records(takeout_path, project_path, streaming=True,
+                                 processes=os.cpu_count() or 1,
+                                 cache_dir=join(project_path,
+                                                PARSE_CACHE_DIR),
+                                 since=since, columnar=True):
             if DBProcessState.exit_thread_check():
                 return
             if isinstance(f, tuple):
@@ -244,7 +281,12 @@ def populate_db(takeout_path: str, project_path: str, logging_verbosity: int):
             else:
                 try:
                     records = f['videos']
-                    if len(records) == 1:  # 1 because of the empty unknown rec
+                    if len(records) == 1 and since:
+                        add_sse_event('No new entries since the last import',
+                                      'info')
+                        add_sse_event(event='stop')
+                        return
+                    elif len(records) == 1:  # 1 because of the empty unknown rec
                         add_sse_event('No records found in the provided '
                                       'watch-history.html file(s). '
                                       'Something is very wrong.', 'errors')
@@ -279,13 +321,13 @@ def populate_db(takeout_path: str, project_path: str, logging_verbosity: int):
     if DBProcessState.exit_thread_check():
         return
 
-    db_path = join(project_path, DB_NAME)
     conn = sqlite_connection(db_path, types=True)
     front_end_data = {'updated': 0}
     try:
         api_auth = youtube.get_api_auth(
             load_file(join(project_path, 'api_key')).strip())
-        write_to_sql.setup_tables(conn, api_auth)
+        quota = write_to_sql.open_quota_account(conn)
+        write_to_sql.setup_tables(conn, api_auth, quota)
         records_at_start = execute_query(
             conn, 'SELECT count(*) from videos')[0][0]
         if not records_at_start:
@@ -299,15 +341,25 @@ def populate_db(takeout_path: str, project_path: str, logging_verbosity: int):
                                 'Takeout...')
         add_sse_event(DBProcessState.stage, 'stage')
 
-        for record in write_to_sql.insert_videos(
-                conn, records, api_auth, logging_verbosity):
-
-            if DBProcessState.exit_thread_check():
-                break
-
-            DBProcessState.percent = str(record[0])
-            add_sse_event(f'{DBProcessState.percent} {record[1]}')
-            front_end_data['updated'] = record[2]
+        api_cache = open_api_cache(project_path)
+        should_stop = lambda: DBProcessState.exit_thread_flag
+        insert = partial(write_to_sql.insert_videos, conn, records, api_auth,
+                         logging_verbosity, since, should_stop=should_stop,
+                         api_cache=api_cache, quota=quota)
+        try:
+            for record in write_to_sql.run_until_done(
+                    insert, conn, quota, should_stop, _announce_quota_wait):
+
+                if DBProcessState.exit_thread_check():
+                    break
+
+                DBProcessState.percent = str(record[0])
+                add_sse_event(f'{DBProcessState.percent} {record[1]}')
+                front_end_data['updated'] = record[2]
+        finally:
+            api_cache.close()
+        if quota.exhausted:
+            add_sse_event(_quota_budget_message(quota), 'warnings')
 
         _show_front_end_data(front_end_data, conn)
         if DBProcessState.stage:
@@ -344,6 +396,7 @@ def update_db(project_path: str, cutoff: int, logging_verbosity: int):
     db_path = join(project_path, DB_NAME)
     conn = sqlite_connection(db_path)
     front_end_data = {'updated': 0,
+                      'unchanged': 0,
                       'failed_api_requests': 0,
                       'newly_inactive': 0,
                       'records_in_db': execute_query(
@@ -354,16 +407,28 @@ def update_db(project_path: str, cutoff: int, logging_verbosity: int):
             load_file(join(project_path, 'api_key')).strip())
         if DBProcessState.exit_thread_check():
             return
-        for record in write_to_sql.update_videos(conn, api_auth, cutoff,
-                                                 logging_verbosity):
-            if DBProcessState.exit_thread_check():
-                break
-            DBProcessState.percent = str(record[0])
-            add_sse_event(f'{DBProcessState.percent} {record[1]}')
-            front_end_data['updated'] = record[2]
-            front_end_data['newly_inactive'] = record[3]
-            front_end_data['newly_active'] = record[4]
-            front_end_data['deleted'] = record[5]
+        api_cache = open_api_cache(project_path)
+        quota = write_to_sql.open_quota_account(conn)
+        should_stop = lambda: DBProcessState.exit_thread_flag
+        update = partial(write_to_sql.update_videos, conn, api_auth, cutoff,
+                         logging_verbosity, should_stop=should_stop,
+                         api_cache=api_cache, quota=quota)
+        try:
+            for record in write_to_sql.run_until_done(
+                    update, conn, quota, should_stop, _announce_quota_wait):
+                if DBProcessState.exit_thread_check():
+                    break
+                DBProcessState.percent = str(record[0])
+                add_sse_event(f'{DBProcessState.percent} {record[1]}')
+                front_end_data['updated'] = record[2]
+                front_end_data['newly_inactive'] = record[3]
+                front_end_data['newly_active'] = record[4]
+                front_end_data['deleted'] = record[5]
+                front_end_data['unchanged'] = record[6]
+        finally:
+            api_cache.close()
+        if quota.exhausted:
+            add_sse_event(_quota_budget_message(quota), 'warnings')
 
         _show_front_end_data(front_end_data, conn)
     except youtube.ApiKeyError:
@@ -0,0 +1,168 @@
+import logging
+import math
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, date
+
+from youtubewatched.config import API_DAILY_QUOTA
+
+"""
+Accounting of the API quota spent by a project. The quota is counted in
+units, each call type costing a set amount of them (QUOTA_COSTS), and resets
+at midnight Pacific time. Units spent each day are kept in the project's
+database, so the budget applies across imports, updates and restarts.
+"""
+
+logger = logging.getLogger(__name__)
+
+# units per call, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {'videos.list': 1, 'videoCategories.list': 1}
+
+QUOTA_USAGE_SCHEMA = '''quota_usage (
+    day text,
+    method text,
+    requests integer,
+    units integer,
+    primary key (day, method)
+    );'''
+
+
+def _nth_sunday(year: int, month: int, n: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(6 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def pacific_time(utc_time: datetime = None) -> datetime:
+    """
+    Converts a naive UTC datetime (now by default) to US Pacific time, which
+    the quota resets by. DST runs from the second Sunday of March until the
+    first Sunday of November, both at 2 AM local time.
+    """
+    if utc_time is None:
+        utc_time = datetime.utcnow()
+    year = utc_time.year
+    dst_start = datetime.combine(_nth_sunday(year, 3, 2),
+                                 datetime.min.time()) + timedelta(hours=10)
+    dst_end = datetime.combine(_nth_sunday(year, 11, 1),
+                               datetime.min.time()) + timedelta(hours=9)
+    offset = 7 if dst_start <= utc_time < dst_end else 8
+    return utc_time - timedelta(hours=offset)
+
+
+def quota_day(utc_time: datetime = None) -> str:
+    """The day quota spent at utc_time counts towards, as YYYY-MM-DD"""
+    return pacific_time(utc_time).date().isoformat()
+
+
+def next_quota_reset(utc_time: datetime = None) -> datetime:
+    """Returns the next midnight Pacific time, as naive UTC"""
+    if utc_time is None:
+        utc_time = datetime.utcnow()
+    midnight = datetime.combine(
+        pacific_time(utc_time).date() + timedelta(days=1),
+        datetime.min.time())
+    reset = midnight + timedelta(hours=8)
+    if pacific_time(reset) != midnight:  # DST
+        reset = midnight + timedelta(hours=7)
+    return reset
+
+
+def estimate_units(videos_amount: int, method: str = 'videos.list') -> int:
+    """Units needed to request videos_amount videos in full batches"""
+    from youtubewatched.youtube import MAX_IDS_PER_REQUEST
+    return (math.ceil(videos_amount / MAX_IDS_PER_REQUEST) *
+            QUOTA_COSTS[method])
+
+
+class QuotaAccount:
+    """
+    Units spent by a project today, and a daily budget for them (the whole
+    daily quota by default).
+
+    Requests are charged with reserve before they're made, which is safe
+    to do from multiple threads; save writes what was charged since the
+    last save to the database and has to be called from the thread conn
+    belongs to. It doesn't commit: the usage is committed by the caller,
+    along with what the requests were made for (e.g. inserted records and
+    the insertion's journal), so that neither is saved without the other.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, budget: int = None):
+        self.conn = conn
+        self.budget = budget if budget is not None else API_DAILY_QUOTA
+        self.lock = threading.Lock()
+        # requests by (day, method), so that the ones charged before the
+        # quota was reset are saved under the day they were made on
+        self.unsaved = Counter()
+        self.exhausted = False  # a request was refused for lack of units
+        conn.execute('CREATE TABLE IF NOT EXISTS ' + QUOTA_USAGE_SCHEMA)
+        self.day = quota_day()
+        self.spent_before = self._load_spent(self.day)
+
+    def _load_spent(self, day: str) -> int:
+        return self.conn.execute(
+            'SELECT coalesce(sum(units), 0) FROM quota_usage WHERE day = ?',
+            (day,)).fetchone()[0]
+
+    def _roll_over(self):
+        day = quota_day()
+        if day != self.day:  # the quota's been reset since
+            self.day = day
+            self.spent_before = 0
+
+    @property
+    def spent(self) -> int:
+        """Units spent today, saved or not"""
+        return self.spent_before + sum(QUOTA_COSTS[method] * requests
+                                       for (day, method), requests
+                                       in self.unsaved.items()
+                                       if day == self.day)
+
+    @property
+    def remaining(self) -> int:
+        return max(self.budget - self.spent, 0)
+
+    def reserve(self, method: str, requests: int = 1) -> bool:
+        """
+        Charges the requests if they fit in what's left of the budget,
+        returns whether they did
+        """
+        with self.lock:
+            self._roll_over()
+            if QUOTA_COSTS[method] * requests > self.remaining:
+                self.exhausted = True
+                return False
+            self.unsaved[self.day, method] += requests
+            return True
+
+    def save(self):
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, Counter()
+            for (day, method), requests in unsaved.items():
+                units = QUOTA_COSTS[method] * requests
+                self.conn.execute('INSERT OR IGNORE INTO quota_usage '
+                                  '(day, method, requests, units) '
+                                  'VALUES (?, ?, 0, 0)', (day, method))
+                self.conn.execute('UPDATE quota_usage '
+                                  'SET requests = requests + ?, '
+                                  'units = units + ? '
+                                  'WHERE day = ? AND method = ?',
+                                  (requests, units, day, method))
+                if day == self.day:
+                    self.spent_before += units
+
+    def renew(self):
+        """Starts over after the quota's been reset"""
+        with self.lock:
+            self._roll_over()
+            self.exhausted = False
+
+    def usage(self, day: str = None) -> dict:
+        """Requests and units by method for the day (today by default)"""
+        self.save()
+        rows = self.conn.execute(
+            'SELECT method, requests, units FROM quota_usage WHERE day = ?',
+            (day or self.day,)).fetchall()
+        return {method: {'requests': requests, 'units': units}
+                for method, requests, units in rows}
@@ -134,6 +134,10 @@ let onEventStats = function(event) {
     if (msgJSON["updated"] !== 0) {
         msgString += "Updated: " + msgJSON["updated"] + "<br>";
     }
+    if (msgJSON.hasOwnProperty("unchanged") && msgJSON["unchanged"] !== 0) {
+        msgString += "Unchanged since the last update: " +
+            msgJSON["unchanged"] + "<br>";
+    }
     if (msgJSON.hasOwnProperty("newly_inactive") && msgJSON["newly_inactive"] !== 0) {
         msgString += "Videos no longer available through API (likely taken down): " +
             msgJSON["newly_inactive"] + "<br>";
@@ -243,7 +247,9 @@ function processTakeout(event) {
     anAJAX.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
     if (idOfElementActedOn === "takeout-form") {
         let takeoutDirectoryVal = document.querySelector("#takeout-input").value;
-        anAJAX.send("takeout-dir=" + takeoutDirectoryVal + "&logging-verbosity-level=" + logging_verbosity);
+        let fullReconcile = document.querySelector("#full-reconcile").checked;
+        anAJAX.send("takeout-dir=" + takeoutDirectoryVal + "&logging-verbosity-level=" + logging_verbosity +
+        "&full-reconcile=" + fullReconcile);
     } else {
         let updateCutoff = document.querySelector("#update-form input[name='update-cutoff']").value;
         let updateCutoffDenomination = document.querySelector("#update-cutoff-periods").value;
@@ -0,0 +1,103 @@
+import logging
+import sqlite3
+import threading
+from collections import Counter
+
+"""
+The tags table's IDs, kept in memory for as long as the process runs, so
+that each insertion/update doesn't have to load the whole table and each
+new tag doesn't take an insert and a select of its own.
+"""
+
+logger = logging.getLogger(__name__)
+
+# tags looked up by this process, by whether their ID was cached: 'hits' or
+# 'misses'
+lookup_counts = Counter()
+
+
+class TagCache:
+    """
+    Tag: ID for a database's tags table. Tags that aren't in it yet are
+    inserted in bulk (see resolve) and their IDs read back with a single
+    query, as tags are never deleted and SQLite gives new rows IDs greater
+    than the largest one so far.
+
+    Before each run, sync checks that the table is still the one the cache
+    has seen (the database may have been rebuilt in the meantime) and picks
+    up tags added by other processes.
+
+    The web app's insertion and update threads share a database's cache, so
+    sync and resolve hold its lock.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.max_id = 0
+        self.max_tag = None  # the tag with max_id
+        self.lock = threading.Lock()
+
+    def sync(self, conn: sqlite3.Connection):
+        with self.lock:
+            max_id = conn.execute('SELECT max(id) FROM tags;'
+                                  ).fetchone()[0] or 0
+            if self.max_id:
+                row = conn.execute('SELECT tag FROM tags WHERE id = ?;',
+                                   (self.max_id,)).fetchone()
+                if max_id < self.max_id or not row or row[0] != self.max_tag:
+                    self.ids.clear()
+                    self.max_id = 0
+                    self.max_tag = None
+            if max_id > self.max_id:
+                self._load_newer(conn)
+
+    def _load_newer(self, conn: sqlite3.Connection):
+        for tag_id, tag in conn.execute('SELECT id, tag FROM tags '
+                                        'WHERE id > ?;', (self.max_id,)):
+            self.ids[tag] = tag_id
+            if tag_id > self.max_id:
+                self.max_id, self.max_tag = tag_id, tag
+
+    def resolve(self, conn: sqlite3.Connection, tags, verbose=False) -> dict:
+        """
+        Returns tag: ID for tags, adding the ones that aren't in the
+        database yet with one executemany, and reading all the new IDs with
+        one query
+        """
+        with self.lock:
+            new = [tag for tag in dict.fromkeys(tags) if tag not in self.ids]
+            lookup_counts['hits'] += len(tags) - len(new)
+            lookup_counts['misses'] += len(new)
+            if new:
+                conn.executemany('INSERT OR IGNORE INTO tags (tag) '
+                                 'VALUES (?);', [(tag,) for tag in new])
+                self._load_newer(conn)
+                missing = [tag for tag in new if tag not in self.ids]
+                if missing:  # only if the cache was out of sync somehow
+                    for tag_id, tag in conn.execute(
+                            f'SELECT id, tag FROM tags WHERE tag IN '
+                            f'({", ".join("?" * len(missing))});', missing):
+                        self.ids[tag] = tag_id
+                if verbose:
+                    for tag in new:
+                        logger.info(f'Added tag {tag!r}')
+            return {tag: self.ids[tag] for tag in tags if tag in self.ids}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def tag_cache_for(conn: sqlite3.Connection) -> TagCache:
+    """
+    Returns the cache of conn's database (by its file), synced with its tags
+    table. In-memory databases get a new cache each time.
+    """
+    path = conn.execute('PRAGMA database_list;').fetchone()[2]
+    if not path:
+        cache = TagCache()
+    else:
+        with _caches_lock:
+            cache = _caches.setdefault(path, TagCache())
+    cache.sync(conn)
+    return cache
@@ -0,0 +1,183 @@
+import bisect
+
+import numpy as np
+
+from youtubewatched.config import MAX_TIME_DIFFERENCE
+
+"""
+Array versions of the timestamp deduplication in utils.gen, for timestamps as
+int64 epoch seconds. Two timestamps are duplicates if they're no further than
+MAX_TIME_DIFFERENCE apart and share the year, month, minute and second, i.e.
+they could be the same one shown in different timezones
+(see are_different_timestamps).
+
+Timestamps are mapped to values on a single axis where duplicates are exactly
+the ones no further than MAX_DIFFERENCE apart, so sorting and diffing finds
+them all at once. Only chains of timestamps each of which is a duplicate of
+the next, but not all of each other, are resolved one by one, since the
+outcome depends on the order they're added in.
+"""
+
+MAX_DIFFERENCE = int(MAX_TIME_DIFFERENCE.total_seconds())
+
+
+def to_epochs(timestamps) -> np.ndarray:
+    """Converts naive datetime objects to epoch seconds, taken as they are"""
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+
+def to_datetimes(epochs: np.ndarray) -> list:
+    return np.asarray(epochs, dtype=np.int64).astype('datetime64[s]').tolist()
+
+
+def _to_axis(epochs: list, groups: list) -> list:
+    """
+    Maps the epochs of each array to a shared axis where timestamps from
+    different groups or with a different year-month/minute-second are
+    further than MAX_DIFFERENCE apart
+    """
+    all_epochs = np.concatenate(epochs)
+    if not len(all_epochs):
+        return [np.empty(0, dtype=np.int64) for _ in epochs]
+    months = all_epochs.astype('datetime64[s]').astype(
+        'datetime64[M]').astype(np.int64)
+    months -= months.min()
+    keys = (np.concatenate(groups) * (months.max() + 1) + months) * 3600
+    keys += all_epochs % 3600
+    ranks = np.unique(keys, return_inverse=True)[1].astype(np.int64)
+
+    lowest = all_epochs.min()
+    span = all_epochs.max() - lowest + 2 * MAX_DIFFERENCE + 1
+    on_axis = ranks * span + (all_epochs - lowest)
+    return np.split(on_axis, np.cumsum([len(e) for e in epochs])[:-1])
+
+
+def _clusters(sorted_values: np.ndarray):
+    """
+    Returns starts and ends of the runs of sorted values where each is a
+    duplicate of the next
+    """
+    breaks = np.diff(sorted_values) > MAX_DIFFERENCE
+    starts = np.flatnonzero(np.concatenate(([True], breaks)))
+    ends = np.append(starts[1:], len(sorted_values))
+    return starts, ends
+
+
+def first_unique_mask(epochs: np.ndarray, groups: np.ndarray = None
+                      ) -> np.ndarray:
+    """
+    Marks the timestamps that would be kept by adding them one after another,
+    in array order, via timestamp_is_unique_in_list(insert=True), with a
+    separate list for each group (ex. video)
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    keep = np.ones(len(epochs), dtype=bool)
+    if len(epochs) < 2:
+        return keep
+    if groups is None:
+        groups = np.zeros(len(epochs), dtype=np.int64)
+    values = _to_axis([epochs], [np.asarray(groups, dtype=np.int64)])[0]
+
+    order = np.argsort(values, kind='stable')  # ties stay in added order
+    sorted_values = values[order]
+    starts, ends = _clusters(sorted_values)
+    sizes = ends - starts
+    if (sizes == 1).all():
+        return keep
+
+    keep[:] = False
+    keep[order[starts[sizes == 1]]] = True
+    # where all are duplicates of each other, only the one added first stays
+    tight = (sizes > 1) & (sorted_values[ends - 1] - sorted_values[starts]
+                           <= MAX_DIFFERENCE)
+    keep[np.minimum.reduceat(order, starts)[tight]] = True
+
+    for start, end in zip(starts[(sizes > 1) & ~tight],
+                          ends[(sizes > 1) & ~tight]):
+        kept = []
+        for ind in np.sort(order[start:end]):
+            value = values[ind]
+            nearest = bisect.bisect_left(kept, value - MAX_DIFFERENCE)
+            if nearest == len(kept) or kept[nearest] > value + MAX_DIFFERENCE:
+                bisect.insort_left(kept, value)
+                keep[ind] = True
+    return keep
+
+
+def is_duplicate_mask(candidates: np.ndarray, incumbents: np.ndarray
+                      ) -> np.ndarray:
+    """
+    Marks the candidates that are duplicates of any of the incumbents, i.e.
+    aren't unique according to timestamp_is_unique_in_list
+    """
+    candidates = np.asarray(candidates, dtype=np.int64)
+    incumbents = np.asarray(incumbents, dtype=np.int64)
+    if not len(candidates) or not len(incumbents):
+        return np.zeros(len(candidates), dtype=bool)
+    candidates, incumbents = _to_axis(
+        [candidates, incumbents],
+        [np.zeros(len(candidates), dtype=np.int64),
+         np.zeros(len(incumbents), dtype=np.int64)])
+    incumbents.sort()
+    nearest = np.searchsorted(incumbents, candidates - MAX_DIFFERENCE)
+    found = nearest < len(incumbents)
+    duplicate = np.zeros(len(candidates), dtype=bool)
+    duplicate[found] = (incumbents[nearest[found]] <=
+                        candidates[found] + MAX_DIFFERENCE)
+    return duplicate
+
+
+def remove_duplicates(filter_: np.ndarray, filteree: np.ndarray
+                      ) -> np.ndarray:
+    """
+    Returns the sorted filteree without the timestamps that
+    remove_timestamps_from_one_list_from_another would remove: each
+    timestamp of filter_, in order, removes the earliest duplicate of
+    itself left in filteree
+    """
+    filter_ = np.asarray(filter_, dtype=np.int64)
+    filteree = np.asarray(filteree, dtype=np.int64)
+    if not len(filter_) or not len(filteree):
+        return filteree
+    filter_values, filteree_values = _to_axis(
+        [filter_, filteree],
+        [np.zeros(len(filter_), dtype=np.int64),
+         np.zeros(len(filteree), dtype=np.int64)])
+
+    values = np.concatenate([filteree_values, filter_values])
+    # filteree first among equal values, so ranks below follow its order
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    is_filteree = order < len(filteree)
+    starts, ends = _clusters(sorted_values)
+
+    filteree_seen = np.cumsum(is_filteree)
+    filteree_before = np.concatenate(([0], filteree_seen))[starts]
+    filteree_amounts = filteree_seen[ends - 1] - filteree_before
+    filter_amounts = (ends - starts) - filteree_amounts
+    affected = (filteree_amounts > 0) & (filter_amounts > 0)
+
+    keep = np.ones(len(filteree), dtype=bool)
+    # where all are duplicates of each other, the filter takes out the
+    # earliest ones, as many as it has
+    tight = affected & (sorted_values[ends - 1] - sorted_values[starts]
+                        <= MAX_DIFFERENCE)
+    cluster_of = np.repeat(np.arange(len(starts)), ends - starts)
+    rank = filteree_seen - 1 - filteree_before[cluster_of]
+    removed = (is_filteree & tight[cluster_of] &
+               (rank < filter_amounts[cluster_of]))
+    keep[order[removed]] = False
+
+    for start, end in zip(starts[affected & ~tight], ends[affected & ~tight]):
+        members = order[start:end]
+        left = sorted((filteree_values[ind], ind)
+                      for ind in members[members < len(filteree)])
+        left_values = [value for value, _ in left]
+        for ind in np.sort(members[members >= len(filteree)]):
+            value = filter_values[ind - len(filteree)]
+            nearest = bisect.bisect_left(left_values, value - MAX_DIFFERENCE)
+            if (nearest < len(left_values) and
+                    left_values[nearest] <= value + MAX_DIFFERENCE):
+                keep[left.pop(nearest)[1]] = False
+                left_values.pop(nearest)
+    return filteree[keep]
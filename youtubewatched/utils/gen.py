@@ -1,7 +1,7 @@
 import bisect
 import logging
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 from logging import handlers
 
 from youtubewatched.config import MAX_TIME_DIFFERENCE
@@ -59,7 +59,8 @@ def logging_config(log_file_path: str,
 
     app_logger = logging.getLogger('youtubewatched')
     app_logger.setLevel(file_level)
-    app_logger.handlers.pop()  # remove the default stream handler
+    if app_logger.handlers:  # not there without the Flask app (CLI)
+        app_logger.handlers.pop()  # remove the default stream handler
     for handler in (file_handler, console_out_handler, console_err_handler):
         app_logger.addHandler(handler)
 
@@ -119,6 +120,18 @@ def timestamp_is_unique_in_list(candidate, timestamps, insert=False):
     return True
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_epoch(dt: datetime) -> int:
+    """Seconds since the epoch for a naive timestamp, taken as is (no TZ)"""
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+def epoch_to_datetime(seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+
 def load_file(path: str):
     with open(path, 'r') as file:
         return file.read()
@@ -113,3 +113,54 @@ def execute_query(conn: sqlite3.Connection,
         raise
     finally:
         cur.close()
+
+
+class BatchWriter:
+    """
+    Collects rows per query and inserts them with executemany, once
+    batch_size rows have been added in all or flush is called. Meant for
+    INSERT OR IGNORE queries, whose failures (e.g. foreign key constraint
+    ones, which OR IGNORE doesn't cover) are only expected once in a while:
+    if a batch fails, its rows are inserted again one by one with
+    execute_query, which logs the failures as usual.
+
+    before_flush, if set, is called at the start of each flush, e.g. to add
+    rows whose values are worked out for the whole batch at once.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = 5000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.rows = {}  # (query, log_integrity_fail): [values, ...]
+        self.pending = 0
+        self.before_flush = None
+
+    def add(self, query: str, values: tuple, log_integrity_fail=True):
+        self.rows.setdefault((query, log_integrity_fail), []).append(values)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Inserts the rows added so far, in the order the queries were"""
+        if self.before_flush:
+            self.before_flush()
+        for (query, log_integrity_fail), rows in self.rows.items():
+            try:
+                self.conn.executemany(query, rows)
+            except sqlite3.IntegrityError:
+                for values in rows:
+                    execute_query(self.conn, query, values,
+                                  log_integrity_fail)
+        self.rows.clear()
+        self.pending = 0
+
+    def flushing(self, items):
+        """
+        Yields from items, flushing once they run out or raise, e.g. so that
+        what's been added is committed if the caller commits on an error
+        """
+        try:
+            yield from items
+        finally:
+            self.flush()
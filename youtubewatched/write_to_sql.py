@@ -1,22 +1,33 @@
 import bisect
+import collections
 import json
 import logging
 import itertools
 import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Union
 
 from youtubewatched import youtube
-from youtubewatched.config import video_keys_and_columns, MAX_TIME_DIFFERENCE
+from youtubewatched.api_cache import ApiResponseCache
+from youtubewatched.columnar_records import ColumnarRecords
+from youtubewatched.config import (video_keys_and_columns, MAX_TIME_DIFFERENCE,
+                                   API_CONCURRENCY, API_REQUESTS_PER_SECOND,
+                                   API_DAILY_QUOTA, API_RETRIES)
+from youtubewatched.quota import (QuotaAccount, estimate_units,
+                                  next_quota_reset)
+from youtubewatched.tag_cache import tag_cache_for
 from youtubewatched.topics import topics
-from youtubewatched.utils.sql import execute_query
+from youtubewatched.utils.sql import execute_query, BatchWriter
 from youtubewatched.utils.sql import (generate_insert_query,
                                       generate_unconditional_update_query)
+from youtubewatched.utils.dedupe import (
+    is_duplicate_mask, remove_duplicates, to_datetimes, to_epochs)
 from youtubewatched.utils.gen import (
     are_different_timestamps,
-    timestamp_is_unique_in_list,
-    remove_timestamps_from_one_list_from_another)
+    timestamp_is_unique_in_list)
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +71,7 @@ TABLE_SCHEMAS = {
     dislike_count integer,
     comment_count integer,
     stream text,
+    etag text,
     foreign key (channel_id) references channels (id)
     on update cascade on delete cascade
     );''',
@@ -94,6 +106,25 @@ TABLE_SCHEMAS = {
     # minimal identifying data, such as title
     'dead_videos_ids': '''dead_videos_ids (
     id text primary key
+    );''',
+
+    # bookkeeping of the app's own, ex. the newest timestamp imported so far
+    'project_state': '''project_state (
+    key text primary key,
+    value text
+    );''',
+
+    # unfinished insert and update jobs, as of their last commit, for them to
+    # resume from after a crash or a stop; signature is what the job was
+    # started with (the amount of records to insert, or the update's cutoff),
+    # position and last_id how far an insert got (updates resume by
+    # started_at)
+    'jobs': '''jobs (
+    kind text primary key,
+    signature text,
+    started_at timestamp,
+    position integer,
+    last_id text
     );'''
 }
 
@@ -106,23 +137,37 @@ VIDEOS_TAGS_COLUMNS = ['video_id', 'tag_id']
 VIDEOS_TOPICS_COLUMNS = ['video_id', 'topic_id']
 VIDEOS_TIMESTAMPS_COLUMNS = ['video_id', 'watched_at']
 DEAD_VIDEOS_IDS_COLUMNS = ['id']
+PROJECT_STATE_COLUMNS = ['key', 'value']
+JOBS_COLUMNS = ['kind', 'signature', 'started_at', 'position', 'last_id']
+# columns added to the schemas above after the tables were first created,
+# added to databases of older versions by upgrade_tables
+ADDED_COLUMNS = {'videos': [('etag', 'text')]}
 
 # below are rigid insert queries, ones whose amount of columns will not change
 # between records
 # add_channel and add_video are compiled every run due to dynamic col amount
-add_tag_query = generate_insert_query('tags', columns=TAGS_COLUMNS)
+# these three are ignored if already there (duplicate tags in a record, or
+# timestamps that are known already), and are written in batches when
+# inserting/updating (see utils.sql.BatchWriter)
 add_tag_to_video_query = generate_insert_query('videos_tags',
-                                               columns=VIDEOS_TAGS_COLUMNS)
+                                               columns=VIDEOS_TAGS_COLUMNS,
+                                               on_conflict_ignore=True)
 add_topic_to_video_query = generate_insert_query('videos_topics',
-                                                 columns=VIDEOS_TOPICS_COLUMNS)
+                                                 columns=VIDEOS_TOPICS_COLUMNS,
+                                                 on_conflict_ignore=True)
 add_time_to_video_query = generate_insert_query(
     'videos_timestamps',
-    columns=VIDEOS_TIMESTAMPS_COLUMNS)
+    columns=VIDEOS_TIMESTAMPS_COLUMNS, on_conflict_ignore=True)
 delete_time_query = '''DELETE FROM videos_timestamps
                        WHERE video_id = ? AND watched_at = ?'''
 add_dead_video_query = generate_insert_query('dead_videos_ids',
                                              columns=DEAD_VIDEOS_IDS_COLUMNS,
                                              on_conflict_ignore=True)
+set_project_state_query = generate_insert_query(
+    'project_state', columns=PROJECT_STATE_COLUMNS).replace(
+    'INSERT', 'INSERT OR REPLACE', 1)
+save_job_query = generate_insert_query('jobs', columns=JOBS_COLUMNS).replace(
+    'INSERT', 'INSERT OR REPLACE', 1)
 
 
 def get_final_key_paths(
@@ -287,6 +332,16 @@ def wrangle_video_record(json_obj: dict):
     return entry_dict
 
 
+def _wrangle_response(api_response: dict) -> tuple:
+    """
+    Returns the response along with its video's wrangled data (None if it has
+    no items), for get_api_responses to prepare in its worker threads
+    """
+    if api_response['items']:
+        return api_response, wrangle_video_record(api_response['items'])
+    return api_response, None
+
+
 def add_channel(conn: sqlite3.Connection, channel_id: str,
                 channel_name: str = None, verbose=False) -> bool:
     values = [channel_id]
@@ -336,64 +391,86 @@ def update_video(conn: sqlite3.Connection, cols_vals: dict, verbose=False):
         return True
 
 
-def add_tag(conn: sqlite3.Connection, tag: str, verbose=False):
-    if execute_query(conn, add_tag_query, (tag,)):
-        if verbose:
-            logger.info(f'Added tag {tag!r}')
+def _insert(conn: sqlite3.Connection, query: str, values: tuple,
+            log_integrity_fail=True, writer: BatchWriter = None):
+    if writer:
+        writer.add(query, values, log_integrity_fail)
         return True
+    return execute_query(conn, query, values, log_integrity_fail)
 
 
 def add_tag_to_video(conn: sqlite3.Connection, tag_id: int, video_id: str,
-                     verbose=False):
-    if execute_query(conn, add_tag_to_video_query, (video_id, tag_id)):
+                     verbose=False, writer: BatchWriter = None):
+    if _insert(conn, add_tag_to_video_query, (video_id, tag_id),
+               writer=writer):
         if verbose:
             logger.info(f'Added tag id# {tag_id} to {video_id!r}')
         return True
 
 
-def add_tags_to_table_and_videos(conn: sqlite3.Connection, tags: list,
-                                 video_id: str, existing_tags: dict,
-                                 existing_videos_tags_records: dict = None,
-                                 verbose=False):
-
-    id_query_string = 'SELECT id FROM tags WHERE tag = ?'
-    for tag in tags:
-        if tag not in existing_tags:
-            tag_id = None
-            if add_tag(conn, tag):
-                if verbose:
-                    logger.info(f'Added tag {tag!r}')
-                tag_id = execute_query(conn, id_query_string, (tag,))[0][0]
-                existing_tags[tag] = tag_id
+class TagLinker:
+    """
+    Adds tags to videos, along with writer's other rows: the tags' IDs (and
+    the tags themselves, if they're new) are resolved for all the videos
+    added in between two flushes of writer at once (see
+    tag_cache.TagCache.resolve).
+    """
 
-        else:
-            tag_id = existing_tags[tag]
-        if tag_id:
-            if existing_videos_tags_records:
-                if existing_videos_tags_records.get(video_id):
-                    if tag_id not in existing_videos_tags_records[video_id]:
-                        if add_tag_to_video(conn, tag_id, video_id) and verbose:
-                            logger.info(f'Added {tag!r} to {video_id!r}')
-            else:
-                if add_tag_to_video(conn, tag_id, video_id) and verbose:
-                    # duplicate tags are possible in a record, but happen
-                    # rarely and are allowed to throw some integrity errors
-                    # (caught and logged)
-                    logger.info(f'Added {tag!r} to {video_id!r}')
+    def __init__(self, conn: sqlite3.Connection, writer: BatchWriter,
+                 verbose=False):
+        self.conn = conn
+        self.writer = writer
+        self.verbose = verbose
+        self.cache = tag_cache_for(conn)
+        self.pending = []  # (video_id, tags, IDs of tags it already has)
+        writer.before_flush = self.flush
+
+    def add(self, video_id: str, tags: list, known_tag_ids=()):
+        self.pending.append((video_id, tags, known_tag_ids))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        tag_ids = self.cache.resolve(
+            self.conn, [tag for _, tags, _ in pending for tag in tags],
+            self.verbose)
+        for video_id, tags, known_tag_ids in pending:
+            for tag in tags:
+                tag_id = tag_ids.get(tag)
+                # duplicate tags are possible in a record, but happen rarely
+                # and are ignored by the query
+                if tag_id and tag_id not in known_tag_ids:
+                    if add_tag_to_video(self.conn, tag_id, video_id,
+                                        writer=self.writer) and self.verbose:
+                        logger.info(f'Added {tag!r} to {video_id!r}')
+
+
+def add_tags_to_table_and_videos(tag_linker: TagLinker, tags: list,
+                                 video_id: str,
+                                 existing_videos_tags_records: dict = None):
+    if existing_videos_tags_records:
+        known_tag_ids = existing_videos_tags_records.get(video_id)
+        if not known_tag_ids:
+            return
+    else:
+        known_tag_ids = ()
+    tag_linker.add(video_id, tags, known_tag_ids)
 
 
 def add_topic_to_video(conn: sqlite3.Connection, topic: str, video_id: str,
-                       verbose=False):
-    if execute_query(conn, add_topic_to_video_query, (video_id, topic)):
+                       verbose=False, writer: BatchWriter = None):
+    if _insert(conn, add_topic_to_video_query, (video_id, topic),
+               writer=writer):
         if verbose:
             logger.info(f'Added topic {topic!r} to {video_id!r}')
         return True
 
 
 def add_time(conn: sqlite3.Connection, watched_at: str, video_id: str,
-             verbose=False):
-    if execute_query(
-            conn, add_time_to_video_query, (video_id, watched_at), False):
+             verbose=False, writer: BatchWriter = None):
+    if _insert(conn, add_time_to_video_query, (video_id, watched_at), False,
+               writer):
         if verbose:
             logger.info(f'Added timestamp {watched_at} to {video_id!r}')
         return True
@@ -420,10 +497,268 @@ def delete_dead_video(conn: sqlite3.Connection, video_id, verbose=False):
         return True
 
 
+def _iter_batches(items, get_id, needs_response):
+    """
+    Groups items into batches of up to youtube.MAX_IDS_PER_REQUEST, yielding
+    each with the IDs of the videos to request for it
+    """
+    def with_ids(batch_):
+        return batch_, [get_id(item_) for item_ in batch_
+                        if not needs_response or needs_response(item_)]
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == youtube.MAX_IDS_PER_REQUEST:
+            yield with_ids(batch)
+            batch = []
+    if batch:
+        yield with_ids(batch)
+
+
+def get_api_responses(items, api_auth, get_id=None, needs_response=None,
+                      concurrency: int = API_CONCURRENCY,
+                      requests_per_second: float = API_REQUESTS_PER_SECOND,
+                      should_stop=None, api_cache: ApiResponseCache = None,
+                      cache_max_age: int = None, quota: QuotaAccount = None,
+                      prepare=None):
+    """
+    Yields (item, API response for its video) for each of items, in order,
+    requesting the videos in batches of up to youtube.MAX_IDS_PER_REQUEST,
+    up to concurrency batches at a time. Batches that fail with a server,
+    transport or rate limit error are retried with backoff, up to
+    API_RETRIES attempts in all; the response is False if the batch failed
+    for good, or None for items that needs_response returned False for.
+
+    The requests, cache lookups and prepare run in worker threads, while the
+    caller consumes (and writes) earlier batches; they're kept at most
+    concurrency * 2 batches ahead of it.
+
+    An ApiKeyError/ApiQuotaError from any of the requests stops the rest from
+    being made and is raised here. Returns early if should_stop returns True,
+    or once quota's budget doesn't allow for any more requests.
+
+    :param items: video IDs, or anything get_id gets them from
+    :param api_auth:
+    :param get_id: returns the video ID of an item
+    :param needs_response: returns whether an item needs the API's response
+    :param concurrency: number of threads making requests
+    :param requests_per_second: average limit shared by the threads
+    :param should_stop: checked between requests and records
+    :param api_cache: responses are taken from it, where they're fresh
+    enough, instead of requested, and requested ones are added to it
+    :param cache_max_age: limits the age of responses taken from api_cache
+    further than its own max_age
+    :param quota: each request is charged to it before being made
+    :param prepare: called in the worker threads with each response (not
+    the False/None ones), yielded is what it returns instead
+    """
+    if get_id is None:
+        def get_id(item):
+            return item
+    limiter = youtube.TokenBucket(requests_per_second)
+    stop = threading.Event()
+    failures = []  # key/quota errors that stopped the requests
+
+    def request(ids):
+        if not ids:
+            return {}
+        try:
+            for attempt in range(1, API_RETRIES + 1):
+                if (stop.is_set() or (should_stop and should_stop()) or
+                        not limiter.acquire(stop)):
+                    return
+                if quota and not quota.reserve('videos.list'):
+                    stop.set()
+                    return
+                try:
+                    with youtube.http_pool.connection() as http:
+                        responses = youtube.get_videos_info(ids, api_auth,
+                                                            http)
+                except youtube.ApiTransientError as e:
+                    kind = e.kind
+                except youtube.ApiQuotaError as e:
+                    if e.daily or attempt == API_RETRIES:
+                        raise
+                    kind = 'rate_limit'
+                else:
+                    if not responses:  # not worth retrying
+                        return dict.fromkeys(ids, False)
+                    if api_cache:
+                        api_cache.put(responses)
+                    return responses
+                if attempt < API_RETRIES:
+                    youtube.count_retry(kind)
+                    if stop.wait(youtube.backoff_delay(attempt)):
+                        return
+            return dict.fromkeys(ids, False)
+        except (youtube.ApiKeyError, youtube.ApiQuotaError) as e:
+            failures.append(e)
+            stop.set()
+            raise
+
+    def fetch(ids):
+        cached = api_cache.get(ids, cache_max_age) if api_cache else {}
+        responses = request([id_ for id_ in ids if id_ not in cached])
+        if responses is None:
+            return
+        responses.update(cached)
+        if prepare:
+            responses = {id_: prepare(response) if response else response
+                         for id_, response in responses.items()}
+        return responses
+
+    batches = _iter_batches(items, get_id, needs_response)
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max(concurrency, 1))
+    try:
+        while True:
+            # requests for a few batches ahead are kept going
+            for batch, ids in itertools.islice(
+                    batches, max(concurrency, 1) * 2 - len(pending)):
+                pending.append((batch, executor.submit(fetch, ids)))
+            if not pending:
+                break
+            batch, future = pending.popleft()
+            responses = future.result()
+            if failures:
+                raise failures[0]
+            if responses is None:
+                return  # stopped
+            for item in batch:
+                if should_stop and should_stop():
+                    return
+                yield item, responses.get(get_id(item))
+    finally:
+        stop.set()
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def get_project_state(conn: sqlite3.Connection, key: str):
+    try:
+        value = conn.execute('SELECT value FROM project_state WHERE key = ?',
+                             (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return  # tables haven't been set up yet
+    if value:
+        return value[0]
+
+
+def set_project_state(conn: sqlite3.Connection, key: str, value):
+    return execute_query(conn, set_project_state_query, (key, str(value)))
+
+
+def get_job(conn: sqlite3.Connection, kind: str,
+            signature) -> Union[dict, None]:
+    """
+    Returns the unfinished job of the kind ('insert' or 'update') as of its
+    last commit, if it was started with the same signature
+    """
+    row = conn.execute('SELECT * FROM jobs WHERE kind = ?;',
+                       (kind,)).fetchone()
+    if row is not None:
+        job = dict(zip(JOBS_COLUMNS, row))
+        if job['signature'] == str(signature):
+            if isinstance(job['started_at'], str):  # connection without types
+                job['started_at'] = datetime.strptime(job['started_at'],
+                                                      '%Y-%m-%d %H:%M:%S')
+            return job
+
+
+def save_job(conn: sqlite3.Connection, kind: str, signature,
+             started_at: datetime, position: int, last_id: str = None):
+    """Journals the job's progress, to be committed along with it"""
+    return execute_query(conn, save_job_query,
+                         (kind, str(signature), started_at, position,
+                          last_id))
+
+
+def end_job(conn: sqlite3.Connection, kind: str):
+    return execute_query(conn, 'DELETE FROM jobs WHERE kind = ?;', (kind,))
+
+
+def get_watermark(conn: sqlite3.Connection) -> Union[datetime, None]:
+    """
+    Returns the newest timestamp added from Takeout so far. Takeout entries
+    older than that (with some leeway for timezones) are already in the
+    database, unless an older archive is added later.
+    """
+    watermark = get_project_state(conn, 'watermark')
+    if watermark:
+        return datetime.strptime(watermark, '%Y-%m-%d %H:%M:%S')
+
+
+def set_watermark(conn: sqlite3.Connection, newest_timestamp: datetime):
+    watermark = get_watermark(conn)
+    if watermark is None or newest_timestamp > watermark:
+        set_project_state(conn, 'watermark',
+                          newest_timestamp.replace(microsecond=0))
+
+
+def get_quota_budget(conn: sqlite3.Connection) -> int:
+    budget = get_project_state(conn, 'quota_budget')
+    return int(budget) if budget else API_DAILY_QUOTA
+
+
+def set_quota_budget(conn: sqlite3.Connection, budget: int):
+    """Sets the units the project can spend per day, 0 for the full quota"""
+    execute_query(conn, 'CREATE TABLE IF NOT EXISTS ' +
+                  TABLE_SCHEMAS['project_state'])
+    set_project_state(conn, 'quota_budget', budget or '')
+    conn.commit()
+
+
+def open_quota_account(conn: sqlite3.Connection,
+                       budget: int = None) -> QuotaAccount:
+    """
+    Returns the project's quota account, with its daily budget, unless a
+    different one is passed
+    """
+    return QuotaAccount(conn, budget or get_quota_budget(conn))
+
+
+def get_categories(api_auth, quota: QuotaAccount = None):
+    """
+    Returns youtube.get_categories' response, retrying server, transport and
+    rate limit errors with backoff the way get_api_responses does, or False
+    if the request failed for good. Returns None if quota's budget doesn't
+    allow for the request.
+    """
+    for attempt in range(1, API_RETRIES + 1):
+        if quota and not quota.reserve('videoCategories.list'):
+            return
+        try:
+            return youtube.get_categories(api_auth)
+        except youtube.ApiTransientError as e:
+            kind = e.kind
+        except youtube.ApiQuotaError as e:
+            if e.daily:
+                raise
+            kind = 'rate_limit'
+        if attempt < API_RETRIES:
+            youtube.count_retry(kind)
+            time.sleep(youtube.backoff_delay(attempt))
+    return False
+
+
 def insert_or_refresh_categories(conn: sqlite3.Connection, api_auth,
-                                 refresh: bool = True):
-    """Gets the video categories info from YT API."""
-    categories = youtube.get_categories(api_auth)
+                                 refresh: bool = True,
+                                 quota: QuotaAccount = None):
+    """
+    Gets the video categories info from YT API. The categories already in
+    the table are kept if the request can't be made or fails.
+    """
+    categories = get_categories(api_auth, quota)
+    if categories is None:
+        logger.warning('Not refreshing video categories, the daily quota '
+                       'budget has been used up')
+        return
+    if not categories:
+        logger.warning('Not refreshing video categories, the API request '
+                       'for them failed')
+        return
     query_string = generate_insert_query('categories',
                                          columns=CATEGORIES_COLUMNS,
                                          on_conflict_ignore=True)
@@ -440,6 +775,32 @@ def insert_or_refresh_categories(conn: sqlite3.Connection, api_auth,
         conn.commit()
 
 
+def upgrade_tables(conn: sqlite3.Connection):
+    """
+    Adds the tables and columns that databases made by older versions are
+    missing
+    """
+    for schema in TABLE_SCHEMAS.values():
+        execute_query(conn, 'CREATE TABLE IF NOT EXISTS ' + schema)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = [row[1] for row in
+                    conn.execute(f'PRAGMA table_info({table});').fetchall()]
+        for column, column_type in columns:
+            if column not in existing:
+                execute_query(conn, f'ALTER TABLE {table} '
+                                    f'ADD COLUMN {column} {column_type};')
+    conn.commit()
+
+
+def get_response_etag(api_response: dict) -> Union[str, None]:
+    """
+    Returns the ETag of the video's resource in the response, which changes
+    whenever any of its requested parts (statistics included) do
+    """
+    if api_response and api_response['items']:
+        return api_response['items'][0].get('etag')
+
+
 def insert_topics(conn: sqlite3.Connection):
     query_string = generate_insert_query('topics', columns=TOPICS_COLUMNS,
                                          on_conflict_ignore=True)
@@ -450,47 +811,83 @@ def insert_topics(conn: sqlite3.Connection):
     conn.commit()
 
 
-def setup_tables(conn: sqlite3.Connection, api_auth):
-    for schema in TABLE_SCHEMAS:
-        create_schema_ = 'CREATE TABLE IF NOT EXISTS ' + TABLE_SCHEMAS[schema]
-        execute_query(conn, create_schema_)
+def setup_tables(conn: sqlite3.Connection, api_auth,
+                 quota: QuotaAccount = None):
+    upgrade_tables(conn)
 
-    insert_or_refresh_categories(conn, api_auth, True)
+    insert_or_refresh_categories(conn, api_auth, True, quota)
     insert_topics(conn)
 
     conn.commit()
 
 
-def insert_videos(conn, records: dict, api_auth, verbosity=1):
+def insert_videos(conn, records: dict, api_auth, verbosity=1,
+                  since: datetime = None, concurrency: int = API_CONCURRENCY,
+                  should_stop=None, api_cache: ApiResponseCache = None,
+                  quota: QuotaAccount = None):
+    """
+    Inserts records from Takeout, querying the API for the ones that aren't
+    in the database yet, and advances the watermark once all are processed.
+
+    If since is passed, records are expected to only have timestamps from that
+    point onward (see get_all_records), so only the database's timestamps
+    that could turn out to be duplicates of those are loaded and compared.
+
+    API requests are made concurrently (see get_api_responses); should_stop
+    is checked in between, the insertion ends without committing the rest
+    (or advancing the watermark) once it returns True. Likewise if quota's
+    daily budget runs out, though what's been inserted by then is committed.
+
+    The position in records is journaled with each commit (see get_job), so
+    if the insertion is interrupted, inserting the same records again skips
+    the ones before it. That goes for dicts as well as ColumnarRecords, as
+    records aren't changed while being inserted.
+    """
     verbosity_level_1 = verbosity >= 1
     verbosity_level_2 = verbosity >= 2
     verbosity_level_3 = verbosity >= 3
     records_passed, inserted, updated = 0, 0, 0
+    if isinstance(records, ColumnarRecords):
+        newest_timestamp = records.newest_timestamp()
+    else:
+        newest_timestamp = max((max(record['timestamps'])
+                                for record in records.values()
+                                if record['timestamps']), default=None)
     cur = conn.cursor()
     cur.execute("""SELECT id FROM videos;""")
-    video_ids = [row[0] for row in cur.fetchall()]
+    # sets, as they're checked for each record
+    video_ids = {row[0] for row in cur.fetchall()}
     cur.execute("""SELECT id FROM channels;""")
-    channels = [row[0] for row in cur.fetchall()]
-    cur.execute("""SELECT * FROM tags;""")
-    existing_tags = {v: k for k, v in cur.fetchall()}
-    cur.execute("""SELECT * FROM videos_timestamps;""")
+    channels = {row[0] for row in cur.fetchall()}
+    if since is None:
+        cur.execute("""SELECT * FROM videos_timestamps;""")
+    else:
+        cur.execute("""SELECT * FROM videos_timestamps
+                       WHERE watched_at >= ?;""",
+                    (since - MAX_TIME_DIFFERENCE,))
     db_timestamps = {}
     for timestamp_record in cur.fetchall():
         db_timestamps.setdefault(timestamp_record[0], [])
         db_timestamps[timestamp_record[0]].append(timestamp_record[1])
     cur.execute("""SELECT id FROM dead_videos_ids;""")
-    dead_videos_ids = [dead_video[0] for dead_video in cur.fetchall()]
+    dead_videos_ids = {dead_video[0] for dead_video in cur.fetchall()}
     cur.close()
+    writer = BatchWriter(conn)
+    tag_linker = TagLinker(conn, writer, verbosity_level_3)
     if verbosity_level_1:
         logger.info(f'\nStarting records\' insertion...\n' + '-'*100)
 
     # due to their made up IDs, the youtube_music and unknown records are best
     # handled outside the loop
+    # records themselves are left as they are (the ones that get changed
+    # below are copies), so that they can be inserted again if this is
+    # interrupted
 
     youtube_music_id = 'youtube_music'
-    yt_music_record = records.pop(youtube_music_id, None)
+    yt_music_record = records.get(youtube_music_id)
     yt_music_db_timestamps = db_timestamps.setdefault(youtube_music_id, [])
     if yt_music_record:
+        yt_music_record = dict(yt_music_record)
         yt_music_record['id'] = youtube_music_id
         yt_music_record['title'] = 'YouTube Music'
         yt_music_record['channel_id'] = youtube_music_id
@@ -503,13 +900,17 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
         if youtube_music_id not in video_ids:
             add_video(conn, yt_music_record, verbosity_level_2)
             inserted += 1
-        for candidate in yt_music_timestamps:
-            if timestamp_is_unique_in_list(candidate, yt_music_db_timestamps):
-                add_time(conn, candidate, youtube_music_id, verbosity_level_3)
-
-    unknown_record = records.pop('unknown', None)
+        duplicates = is_duplicate_mask(to_epochs(yt_music_timestamps),
+                                       to_epochs(yt_music_db_timestamps))
+        for candidate, duplicate in zip(yt_music_timestamps, duplicates):
+            if not duplicate:
+                add_time(conn, candidate, youtube_music_id, verbosity_level_3,
+                         writer)
+
+    unknown_record = records.get('unknown')
     unk_db_timestamps = db_timestamps.setdefault('unknown', [])
     if unknown_record:
+        unknown_record = dict(unknown_record)
         unknown_record['id'] = 'unknown'
         unknown_record['title'] = 'unknown'
         unknown_record['channel_id'] = 'unknown'
@@ -523,16 +924,19 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
                                        for v_id in all_known_timestamps_ids]]
         all_known_timestamps = list(itertools.chain.from_iterable(
             all_known_timestamps_lists))
-        remove_timestamps_from_one_list_from_another(all_known_timestamps,
-                                                     unknown_timestamps)
+        unknown_timestamps = to_datetimes(remove_duplicates(
+            to_epochs(all_known_timestamps), to_epochs(unknown_timestamps)))
         if 'unknown' not in channels:
             add_channel(conn, 'unknown', 'unknown', verbosity_level_2)
         if 'unknown' not in video_ids:
             add_video(conn, unknown_record, verbosity_level_2)
             inserted += 1
-        for candidate in unknown_timestamps:
-            if timestamp_is_unique_in_list(candidate, unk_db_timestamps):
-                add_time(conn, candidate, 'unknown', verbosity_level_3)
+        duplicates = is_duplicate_mask(to_epochs(unknown_timestamps),
+                                       to_epochs(unk_db_timestamps))
+        for candidate, duplicate in zip(unknown_timestamps, duplicates):
+            if not duplicate:
+                add_time(conn, candidate, 'unknown', verbosity_level_3,
+                         writer)
 
     def add_known_timestamps_and_remove_from_unknown(new_timestamps):
         db_timestamps.setdefault(video_id, [])
@@ -541,7 +945,7 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
         for new in new_timestamps:
             if timestamp_is_unique_in_list(new,
                                            db_timestamps[video_id]):
-                add_time(conn, new, video_id, verbosity_level_2)
+                add_time(conn, new, video_id, verbosity_level_2, writer)
                 added_timestamps.append(new)
         # clean db unknown timestamps of ones that are now known
         for db_incumbent in added_timestamps:
@@ -558,11 +962,40 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
                                     'unknown', verbose=verbosity_level_1)
                         break
 
-    sub_percent, sub_percent_int = calculate_subpercentage(len(records))
+    takeout_ids = [video_id for video_id in records
+                   if video_id not in (youtube_music_id, 'unknown')]
+    records_amount = len(takeout_ids)
+    sub_percent, sub_percent_int = calculate_subpercentage(records_amount)
     commit_interval = calculate_commit_interval(sub_percent_int)
     commit_interval_counter = 0
-
-    for video_id, record in records.items():
+    job = get_job(conn, 'insert', records_amount)
+    # the same records, as long as the last one journaled is in the same place
+    if job and job['position'] and job['last_id'] == next(itertools.islice(
+            takeout_ids, job['position'] - 1, None), None):
+        started_at, records_passed = job['started_at'], job['position']
+        if verbosity_level_1:
+            logger.info(f'Resuming from record #{records_passed}')
+    else:
+        started_at = datetime.utcnow().replace(microsecond=0)
+    if quota and verbosity_level_1:
+        units = estimate_units(sum(1 for video_id in takeout_ids
+                                   if video_id not in video_ids))
+        logger.info(f'Up to {units} API quota units needed, '
+                    f'{quota.remaining} left in today\'s budget')
+
+    # responses are wrangled in the fetching threads, while earlier records
+    # get written here
+    # what's been batched is written on errors too, so that it's committed
+    # along with the rest in case of an ApiQuotaError (see run_until_done)
+    for (video_id, record), prepared in writer.flushing(get_api_responses(
+            ((video_id, dict(records[video_id])) for video_id in
+             itertools.islice(takeout_ids, records_passed, None)),
+            api_auth, get_id=lambda item: item[0],
+            needs_response=lambda item: item[0] not in video_ids,
+            concurrency=concurrency, should_stop=should_stop,
+            api_cache=api_cache, quota=quota, prepare=_wrangle_response)):
+        api_response, api_video_data = prepared if prepared else (prepared,
+                                                                  None)
         records_passed += 1
         if records_passed % sub_percent_int == 0:
             yield ((records_passed // sub_percent) / 10, records_passed,
@@ -605,26 +1038,22 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
                     updated += 1
             continue
 
-        for attempt in range(1, 6):
-            api_response = youtube.get_video_info(video_id, api_auth)
-            time.sleep(0.01*attempt**attempt)
-            if api_response:
-                if api_response['items']:
-                    api_video_data = wrangle_video_record(api_response['items'])
-                    if len(api_video_data) >= 7:
-                        record.update(api_video_data)
-                        record['status'] = 'active'
-                    else:
-                        record['status'] = 'deleted'
-                        if verbosity_level_1:
-                            logger.info(f'{get_record_id_and_title(record)}, '
-                                        f'is now deleted from YT')
+        if api_response:
+            if api_response['items']:
+                if len(api_video_data) >= 7:
+                    record.update(api_video_data)
+                    record['status'] = 'active'
+                    record['etag'] = get_response_etag(api_response)
                 else:
-                    record['status'] = 'inactive'
+                    record['status'] = 'deleted'
+                    if verbosity_level_1:
+                        logger.info(f'{get_record_id_and_title(record)}, '
+                                    f'is now deleted from YT')
+            else:
+                record['status'] = 'inactive'
 
-                record['last_updated'] = str(datetime.utcnow().replace(
-                    microsecond=0))
-                break
+            record['last_updated'] = str(datetime.utcnow().replace(
+                microsecond=0))
         else:
             record['status'] = 'inactive'
 
@@ -642,8 +1071,10 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
         channel_title = record.pop('channel_title', None)
         channel_id = record['channel_id']
 
-        if add_channel(conn, channel_id, channel_title, verbosity_level_2):
-            channels.append(record['channel_id'])
+        if channel_id in channels or add_channel(conn, channel_id,
+                                                 channel_title,
+                                                 verbosity_level_2):
+            channels.add(channel_id)
         else:
             continue  # nothing else can/should be inserted without the
             # channel for it getting inserted first as channel_id is a foreign
@@ -656,24 +1087,45 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
         candidate_timestamps = record.pop('timestamps')
 
         if add_video(conn, record, verbosity_level_2):
-            video_ids.append(video_id)
+            video_ids.add(video_id)
             inserted += 1
 
         add_known_timestamps_and_remove_from_unknown(candidate_timestamps)
 
         if tags:
-            add_tags_to_table_and_videos(conn, tags, video_id, existing_tags,
-                                         verbose=verbosity_level_3)
+            add_tags_to_table_and_videos(tag_linker, tags, video_id)
 
         if topics_list:
             for topic in topics_list:
-                add_topic_to_video(conn, topic, video_id, verbosity_level_3)
+                add_topic_to_video(conn, topic, video_id, verbosity_level_3,
+                                   writer)
 
         commit_interval_counter += 1
         if commit_interval_counter == commit_interval:
+            writer.flush()
+            if quota:
+                quota.save()
+            save_job(conn, 'insert', records_amount, started_at,
+                     records_passed, video_id)
             conn.commit()
             commit_interval_counter = 0
 
+    if should_stop and should_stop():
+        return
+    if quota:
+        quota.save()
+        if quota.exhausted:
+            if records_passed:
+                save_job(conn, 'insert', records_amount, started_at,
+                         records_passed, takeout_ids[records_passed - 1])
+            conn.commit()
+            logger.warning(f'Stopped after {records_passed} records, the '
+                           f'daily API quota budget ({quota.budget} units) '
+                           f'has been used up')
+            return
+    if newest_timestamp is not None:
+        set_watermark(conn, newest_timestamp)
+    end_job(conn, 'insert')
     conn.commit()
 
     results = {"records_processed": records_passed,
@@ -685,23 +1137,72 @@ def insert_videos(conn, records: dict, api_auth, verbosity=1):
         logger.info('\n' + '-'*100 + f'\nPopulating finished')
 
 
+def get_records_to_update(conn: sqlite3.Connection,
+                          update_age_cutoff=86400,
+                          now: datetime = None) -> list:
+    """
+    Returns the IDs of the records last updated more than update_age_cutoff
+    seconds before now, in the order they're updated in: active ones before
+    inactive ones (which seldom become available again), the least recently
+    updated first
+    """
+    if now is None:  # for determining if the record is old enough
+        now = datetime.utcnow()
+    dt_strp = datetime.strptime
+    dt_format = '%Y-%m-%d %H:%M:%S'
+    rows = conn.execute("""SELECT id, last_updated FROM videos
+                           WHERE title NOT IN (?, ?) AND NOT status = ?
+                           ORDER BY status = ?, last_updated;""",
+                        ('unknown', 'YouTube Music', 'deleted', 'inactive'))
+    return [
+        k for k, v in rows.fetchall() if
+        (now - dt_strp(v, dt_format)).total_seconds() > update_age_cutoff
+    ]
+
+
 def update_videos(conn: sqlite3.Connection, api_auth,
-                  update_age_cutoff=86400, verbosity=1):
+                  update_age_cutoff=86400, verbosity=1,
+                  concurrency: int = API_CONCURRENCY, should_stop=None,
+                  api_cache: ApiResponseCache = None,
+                  quota: QuotaAccount = None):
+    """
+    Refreshes the records last updated more than update_age_cutoff seconds
+    ago with current data from the API, in the order of
+    get_records_to_update. If quota's daily budget runs out, the ones that
+    were refreshed by then are kept and the rest are left for later.
+
+    Yields the progress as (percent, records passed, updated, newly
+    inactive, newly active, deleted from YouTube, unchanged) as it goes, and
+    once more with the final counts at the end, if there were any records.
+
+    The time the update started at is journaled (see get_job), so if it's
+    interrupted, updating with the same update_age_cutoff again continues
+    it, refreshing only the records that were last updated more than
+    update_age_cutoff seconds before that time.
+    """
     verbosity_level_1 = verbosity >= 1
     verbosity_level_2 = verbosity >= 2
     verbosity_level_3 = verbosity >= 3
     records_passed, updated, newly_inactive, newly_active, deleted = [0] * 5
+    unchanged = 0
+    upgrade_tables(conn)
+    job = get_job(conn, 'update', update_age_cutoff)
+    if job:
+        started_at = job['started_at']
+        if verbosity_level_1:
+            logger.info(f'Resuming the update started at {started_at}')
+    else:
+        started_at = datetime.utcnow().replace(microsecond=0)
+        save_job(conn, 'update', update_age_cutoff, started_at, 0)
+        conn.commit()
+    records_filtered_by_age = get_records_to_update(conn, update_age_cutoff,
+                                                    started_at)
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-    cur.execute("""SELECT id, last_updated FROM videos
-                   WHERE title NOT IN (?, ?) AND NOT status = ?
-                   ORDER BY last_updated;""",
-                ('unknown', 'YouTube Music', 'deleted'))
-    records = {k: v for k, v in cur.fetchall()}
+    cur.execute("""SELECT id, etag FROM videos WHERE etag IS NOT NULL;""")
+    etags = {k: v for k, v in cur.fetchall()}
     cur.execute("""SELECT * FROM channels WHERE title is not NULL;""")
     channels = {k: v for k, v in cur.fetchall()}
-    cur.execute("""SELECT * FROM tags;""")
-    existing_tags = {v: k for k, v in cur.fetchall()}
     cur.execute("""SELECT * FROM videos_tags""")
     existing_videos_tags = {}
     for video_tag_entry in cur.fetchall():
@@ -714,79 +1215,105 @@ def update_videos(conn: sqlite3.Connection, api_auth,
         existing_topics_tags[video_topic_entry[0]].append(video_topic_entry[1])
     cur.close()
 
-    now = datetime.utcnow()  # for determining if the record is old enough
-    dt_strp = datetime.strptime
-    dt_format = '%Y-%m-%d %H:%M:%S'
-    records_filtered_by_age = [
-        k for k, v in records.items() if
-        (now - dt_strp(v, dt_format)).total_seconds() > update_age_cutoff
-    ]
     sub_percent, sub_percent_int = calculate_subpercentage(
         len(records_filtered_by_age))
     commit_interval = calculate_commit_interval(sub_percent_int)
     commit_interval_counter = 0
-    del records
+    # records whose ETag hasn't changed only have last_updated set, in bulk
+    unchanged_ids = []
+
+    def mark_unchanged_as_updated():
+        conn.executemany('UPDATE videos SET last_updated = ? WHERE id = ?',
+                         [(datetime.utcnow().replace(microsecond=0), id_)
+                          for id_ in unchanged_ids])
+        unchanged_ids.clear()
 
     if verbosity_level_1:
         logger.info(f'\nStarting records\' updating...\n' + '-'*100)
-    for record in records_filtered_by_age:
+        if quota:
+            logger.info(f'Up to {estimate_units(len(records_filtered_by_age))} '
+                        f'API quota units needed, {quota.remaining} left in '
+                        f'today\'s budget')
+    def wrangle_if_changed(api_response: dict) -> tuple:
+        etag = get_response_etag(api_response)
+        if etag and etag == etags.get(api_response['items'][0]['id']):
+            return api_response, None
+        return _wrangle_response(api_response)
+
+    # cached responses are used if they're as recent as an update would be
+    api_responses = get_api_responses(records_filtered_by_age, api_auth,
+                                      concurrency=concurrency,
+                                      should_stop=should_stop,
+                                      api_cache=api_cache,
+                                      cache_max_age=int(update_age_cutoff),
+                                      quota=quota, prepare=wrangle_if_changed)
+    writer = BatchWriter(conn)
+    tag_linker = TagLinker(conn, writer, verbosity_level_3)
+    for record, prepared in writer.flushing(api_responses):
+        api_response, api_video_data = prepared if prepared else (prepared,
+                                                                  None)
         records_passed += 1
         if records_passed % sub_percent_int == 0:
             yield ((records_passed // sub_percent)/10, records_passed, updated,
-                   newly_inactive, newly_active, deleted)
+                   newly_inactive, newly_active, deleted, unchanged)
+        if not api_response:
+            continue
+        etag = get_response_etag(api_response)
+        if etag and etag == etags.get(record):
+            # nothing's changed since the last update, so there's nothing to
+            # wrangle or rewrite
+            unchanged_ids.append(record)
+            unchanged += 1
+            if verbosity_level_3:
+                logger.info(f'{record!r} is unchanged')
+            if len(unchanged_ids) == commit_interval:
+                mark_unchanged_as_updated()
+                conn.commit()
+            continue
         record = execute_query(conn, 'SELECT * FROM videos WHERE id = ?',
                                (record,))
         record = dict(record[0])
         video_id = record['id']
 
-        for attempt in range(1, 6):
-            api_response = youtube.get_video_info(video_id, api_auth)
-            time.sleep(0.01*attempt**attempt)
-            if api_response:
-                if api_response['items']:
-                    api_video_data = wrangle_video_record(api_response['items'])
-                    if len(api_video_data) >= 7:
-                        # a record must have at least 7 fields after
-                        # going through wrangle_video_record, otherwise it's a
-                        # record of a deleted video with no valid data
-                        api_video_data.pop('published_at', None)
-                        if 'channel_title' not in api_video_data:
-                            # the video is somehow available through API
-                            # (though some data is missing), but not on YouTube
-                            pass
-                        else:
-                            if record['status'] == 'inactive':
-                                record['status'] = 'active'
-                                newly_active += 1
-                                if verbosity_level_1:
-                                    logger.info(
-                                        f'{get_record_id_and_title(record)}, '
-                                        f'is now active')
-                        record.update(api_video_data)
-                    else:
-                        record['status'] = 'deleted'
-                        deleted += 1
-                        if verbosity_level_1:
-                            logger.info(f'{get_record_id_and_title(record)}, '
-                                        f'is now deleted from YT')
+        if api_response['items']:
+            if len(api_video_data) >= 7:
+                # a record must have at least 7 fields after
+                # going through wrangle_video_record, otherwise it's a
+                # record of a deleted video with no valid data
+                api_video_data.pop('published_at', None)
+                if 'channel_title' not in api_video_data:
+                    # the video is somehow available through API
+                    # (though some data is missing), but not on YouTube
+                    pass
                 else:
-                    if record['status'] == 'active':
-                        record['status'] = 'inactive'
-                        newly_inactive += 1
+                    if record['status'] == 'inactive':
+                        record['status'] = 'active'
+                        newly_active += 1
                         if verbosity_level_1:
-                            logger.info(f'{get_record_id_and_title(record)}, '
-                                        f'is now inactive')
-                record['last_updated'] = datetime.utcnow().replace(
-                    microsecond=0)
-                break
+                            logger.info(
+                                f'{get_record_id_and_title(record)}, '
+                                f'is now active')
+                record.update(api_video_data)
+            else:
+                record['status'] = 'deleted'
+                deleted += 1
+                if verbosity_level_1:
+                    logger.info(f'{get_record_id_and_title(record)}, '
+                                f'is now deleted from YT')
         else:
-            continue
+            if record['status'] == 'active':
+                record['status'] = 'inactive'
+                newly_inactive += 1
+                if verbosity_level_1:
+                    logger.info(f'{get_record_id_and_title(record)}, '
+                                f'is now inactive')
+        record['last_updated'] = datetime.utcnow().replace(microsecond=0)
+        record['etag'] = etag if record['status'] == 'active' else None
 
         if 'tags' in record:
             tags = record.pop('tags')
-            add_tags_to_table_and_videos(conn, tags, video_id, existing_tags,
-                                         existing_videos_tags,
-                                         verbosity_level_3)
+            add_tags_to_table_and_videos(tag_linker, tags, video_id,
+                                         existing_videos_tags)
             # perhaps, the record should also be checked for tags that have
             # been removed from the updated version and have them removed from
             # the DB as well. However, keeping a fuller record, despite what
@@ -822,26 +1349,91 @@ def update_videos(conn: sqlite3.Connection, api_auth,
             if existing_topics_tags.get(video_id):
                 for topic in topics_list:
                     if topic not in existing_topics_tags[video_id]:
-                        add_topic_to_video(conn, topic,
-                                           video_id, verbosity_level_2)
+                        add_topic_to_video(conn, topic, video_id,
+                                           verbosity_level_2, writer)
 
         if update_video(conn, record, verbosity_level_3):
             updated += 1
 
         commit_interval_counter += 1
         if commit_interval_counter == commit_interval:
+            writer.flush()
+            mark_unchanged_as_updated()
+            if quota:
+                quota.save()
             conn.commit()
             commit_interval_counter = 0
 
+    if should_stop and should_stop():
+        conn.row_factory = None
+        return
+    mark_unchanged_as_updated()
+    if quota:
+        quota.save()
+    if quota and quota.exhausted:
+        logger.warning(f'Stopped after {records_passed} of '
+                       f'{len(records_filtered_by_age)} records, the '
+                       f'daily API quota budget ({quota.budget} units) '
+                       f'has been used up')
+    else:
+        end_job(conn, 'update')
     conn.commit()
     execute_query(conn, 'VACUUM')
     conn.row_factory = None
+    if records_passed:
+        yield ((records_passed // sub_percent)/10, records_passed, updated,
+               newly_inactive, newly_active, deleted, unchanged)
 
     results = {'records_processed': records_passed,
                'records_updated': updated,
+               'records_unchanged': unchanged,
                'newly_inactive': newly_inactive,
                'newly_active': newly_active,
                'deleted_from_youtube': deleted}
     if verbosity_level_1:
         logger.info(json.dumps(results, indent=4))
         logger.info('\n' + '-'*100 + f'\nUpdating finished')
+
+
+def wait_for_quota_reset(should_stop=None) -> bool:
+    """
+    Sleeps until the API quota resets, at midnight Pacific time. Returns
+    False if should_stop returned True in the meantime.
+    """
+    reset = next_quota_reset()
+    while datetime.utcnow() < reset:
+        if should_stop and should_stop():
+            return False
+        time.sleep(min(5, (reset - datetime.utcnow()).total_seconds()))
+    return True
+
+
+def run_until_done(run, conn: sqlite3.Connection, quota: QuotaAccount,
+                   should_stop=None, on_wait=None):
+    """
+    Yields from run(), i.e. insert_videos or update_videos with their
+    arguments bound, and each time the daily API quota (or quota's budget
+    for it) runs out, waits for it to reset and runs it again, which resumes
+    the job from its journal (see get_job).
+
+    :param on_wait: called with the time (UTC) the quota resets at, before
+    waiting for it
+    """
+    while True:
+        try:
+            yield from run()
+        except youtube.ApiQuotaError as e:
+            if not e.daily:
+                raise
+            quota.save()
+            conn.commit()  # the records passed so far are complete
+            quota.exhausted = True
+        if not quota.exhausted or (should_stop and should_stop()):
+            return
+        reset = next_quota_reset()
+        logger.warning(f'API quota used up, continuing at {reset} UTC')
+        if on_wait:
+            on_wait(reset)
+        if not wait_for_quota_reset(should_stop):
+            return
+        quota.renew()
@@ -1,21 +1,171 @@
 import json
 import logging
-from googleapiclient.discovery import build
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os.path import join, dirname
+from typing import Union
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
-from youtubewatched.config import video_parts_to_get
+from googleapiclient.http import build_http
+from httplib2 import HttpLib2Error
+from youtubewatched.config import (video_parts_to_get, video_keys_parts,
+                                   video_keys_and_columns, API_BACKOFF_BASE,
+                                   API_BACKOFF_CAP)
 
 logger = logging.getLogger(__name__)
 
 YOUTUBE_API_VERSION = 'v3'
 YOUTUBE_API_SERVICE_NAME = 'youtube'
 
+# the parts of the API's discovery document that are used, so that the client
+# can be built without fetching the whole document every time
+DISCOVERY_DOC_PATH = join(dirname(__file__), 'discovery',
+                          f'{YOUTUBE_API_SERVICE_NAME}.'
+                          f'{YOUTUBE_API_VERSION}.json')
+
+# videos.list takes at most this many comma separated IDs
+MAX_IDS_PER_REQUEST = 50
+
+# requests made to the API by this process, by method, e.g. 'videos.list'
+request_counts = Counter()
+# requests retried by this process, by the kind of error that failed them:
+# 'server_error', 'rate_limit' or 'transport'
+retry_counts = Counter()
+_request_counts_lock = threading.Lock()
+
+
+def video_fields_mask() -> str:
+    """
+    Returns the fields parameter for videos.list that limits the response to
+    the keys that get stored (video_keys_and_columns), plus the videos' IDs
+    and ETags, e.g. 'items(id,etag,snippet(title,tags),statistics/viewCount)'
+    """
+    top_level = ['id', 'etag']
+    part_keys = {}
+    for key in video_keys_and_columns:
+        part = video_keys_parts[key]
+        if part is None:
+            if key not in top_level:
+                top_level.append(key)
+        else:
+            part_keys.setdefault(part, []).append(key)
+    fields = top_level + [f'{part}/{keys[0]}' if len(keys) == 1
+                          else f'{part}({",".join(keys)})'
+                          for part, keys in part_keys.items()]
+    return f'items({",".join(fields)})'
+
+
+VIDEO_FIELDS = video_fields_mask()
+
+
+def _count_request(method: str):
+    with _request_counts_lock:
+        request_counts[method] += 1
+
+
+def count_retry(kind: str):
+    with _request_counts_lock:
+        retry_counts[kind] += 1
+
+
+def backoff_delay(attempt: int, base: float = API_BACKOFF_BASE,
+                  cap: float = API_BACKOFF_CAP) -> float:
+    """
+    Seconds to wait before retrying a request that failed attempt times:
+    exponential, capped, with full jitter so concurrent requests that failed
+    together don't retry together
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class HttpPool:
+    """
+    Keep-alive HTTP clients to execute requests with, shared by all threads
+    and kept between runs, so connections to the API are reused instead of
+    made anew for each batch of requests. A client is only used by one thread
+    at a time, as they can't be shared between threads.
+    """
+
+    def __init__(self, factory=build_http):
+        self.factory = factory
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            http = self.idle.pop() if self.idle else None
+        if http is None:
+            http = self.factory()
+        try:
+            yield http
+        finally:
+            with self.lock:
+                self.idle.append(http)
+
+
+http_pool = HttpPool()
+
+
+class TokenBucket:
+    """
+    Limits requests to rate per second on average, allowing bursts of up to
+    capacity requests. Can be shared between threads.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, stop: threading.Event = None) -> bool:
+        """
+        Waits for a token, returns False if stop got set in the meantime
+        """
+        if not self.rate:
+            return True
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
+
 
 class ApiKeyError(ValueError):
     pass
 
 
 class ApiQuotaError(ValueError):
-    pass
+    def __init__(self, message: str, reason: str = None):
+        super().__init__(message)
+        self.reason = reason
+
+    @property
+    def daily(self) -> bool:
+        """Whether it's the daily quota that's run out, not the rate limit"""
+        return self.reason in ['quotaExceeded', 'dailyLimitExceeded']
+
+
+class ApiTransientError(Exception):
+    """A request that failed in a way that may not repeat if retried"""
+
+    def __init__(self, message: str, kind: str):
+        super().__init__(message)
+        self.kind = kind  # 'server_error' or 'transport'
 
 
 def _handle_api_key_error(e):
@@ -23,16 +173,39 @@ def _handle_api_key_error(e):
     reason = err_inf['errors'][0]['reason']
     if reason == 'keyInvalid':
         raise ApiKeyError(f'Invalid API key')
-    if reason in ['quotaExceeded', 'dailyLimitExceeded', 'rateLimitExceeded']:
-        raise ApiQuotaError(f'API quota/rate limit exceeded')
+    if reason in ['quotaExceeded', 'dailyLimitExceeded', 'rateLimitExceeded',
+                  'userRateLimitExceeded']:
+        raise ApiQuotaError(f'API quota/rate limit exceeded', reason)
     return err_inf, reason
 
 
-def get_api_auth(developer_key):
+def _load_discovery_doc() -> str:
+    global _discovery_doc
+    if _discovery_doc is None:
+        with open(DISCOVERY_DOC_PATH, 'r') as file:
+            _discovery_doc = file.read()
+    return _discovery_doc
+
+
+_discovery_doc = None
+
+
+def get_api_auth(developer_key, fetch_discovery=False, http=None):
+    """
+    Builds the API client from the bundled discovery document, or from the
+    one the API serves if fetch_discovery is True (slower). An invalid
+    developer_key is then only noticed by the first request.
+
+    :param http: the client's own transport, a new keep-alive one by default
+    """
     if not developer_key:
         raise ApiKeyError('Please provide an API key.\n'
                           'Create an api_key file in the project directory '
                           'and paste the key there.')
+    if not fetch_discovery:
+        return build_from_document(_load_discovery_doc(),
+                                   developerKey=developer_key,
+                                   http=http or build_http())
     try:
         return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
                      developerKey=developer_key)
@@ -40,28 +213,67 @@ def get_api_auth(developer_key):
         _handle_api_key_error(e)
 
 
-def get_video_info(video_id, api_auth):
+def get_videos_info(video_ids: list, api_auth,
+                    http=None) -> Union[dict, bool]:
+    """
+    Requests up to MAX_IDS_PER_REQUEST videos in a single request (costs the
+    same quota as one for a single video). Returns a dict of video ID: its
+    videos.list response, as if it was requested by itself, with empty items
+    for IDs missing from the response, or False if the request failed.
+    Raises ApiTransientError for server and transport errors, which are
+    worth retrying, unlike the rest.
+
+    Pass http (see HttpPool) when calling from multiple threads.
+    """
+    _count_request('videos.list')
     try:
-        results = api_auth.videos().list(id=video_id,
-                                         part=video_parts_to_get).execute()
-        return results
+        results = api_auth.videos().list(id=','.join(video_ids),
+                                         part=video_parts_to_get,
+                                         fields=VIDEO_FIELDS
+                                         ).execute(http=http)
     except HttpError as e:
+        if e.resp.status >= 500:
+            raise ApiTransientError(f'API server error {e.resp.status}',
+                                    'server_error') from e
         err_inf, reason = _handle_api_key_error(e)
-        logger.error(f'API error: ID# {video_id} retrieval failed\n'
+        logger.error(f'API error: retrieval of {len(video_ids)} IDs failed '
+                     f'({video_ids[0]}...)\n'
                      f'error code: ' + str(err_inf['code']) +
                      '\ndescription: ' + err_inf['message'] +
                      '\nreason: ' + reason)
         return False
+    except (HttpLib2Error, OSError) as e:
+        raise ApiTransientError(f'API request failed: {e!r}',
+                                'transport') from e
+
+    responses = {video_id: {'items': []} for video_id in video_ids}
+    for item in results.get('items', []):
+        if item.get('id') in responses:
+            responses[item['id']]['items'].append(item)
+    return responses
 
 
-def get_categories(api_auth):
+def get_categories(api_auth, http=None):
+    """
+    Returns the videoCategories.list response, or False if the request
+    failed. Raises ApiTransientError for server and transport errors, like
+    get_videos_info.
+    """
+    _count_request('videoCategories.list')
     try:
         return api_auth.videoCategories().list(part='snippet',
-                                               regionCode='US').execute()
+                                               regionCode='US'
+                                               ).execute(http=http)
     except HttpError as e:
+        if e.resp.status >= 500:
+            raise ApiTransientError(f'API server error {e.resp.status}',
+                                    'server_error') from e
         err_inf, reason = _handle_api_key_error(e)
         logger.error(f'Categories\' retrieval failed,\n'
                      f'error code: ' + str(err_inf['code']) +
                      '\ndescription: ' + err_inf['message'] +
                      '\nreason: ' + reason)
         return False
+    except (HttpLib2Error, OSError) as e:
+        raise ApiTransientError(f'API request failed: {e!r}',
+                                'transport') from e